@@ -0,0 +1,208 @@
+"""Load generator and throughput/latency benchmark for the chat server.
+
+Opens many CDProto connections from a single asyncio loop, spreads them over
+channels, lets some of them send timestamped messages and measures how fast
+and how late the copies reach every member of the channels.
+"""
+import argparse
+import asyncio
+import os
+import resource
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+
+from src.protocol import (
+    BINARY,
+    JSON,
+    CDProto,
+    CDProtoDecoder,
+    PingMessage,
+    TextMessage,
+)
+
+
+class BenchClient:
+    """Simulated chat client, counting the messages it receives."""
+
+    def __init__(self, name, channel, wire, stats):
+        self.name = name
+        self.channel = channel
+        self.wire = wire
+        self.stats = stats
+        self.decoder = CDProtoDecoder()
+        self.reader = None
+        self.writer = None
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        wire = None if self.wire == JSON else self.wire
+        self.writer.write(CDProto.encode_msg(CDProto.register(self.name, wire)))
+        self.decoder.wire = self.wire
+        self.writer.write(CDProto.encode_msg(CDProto.join(self.channel), self.wire))
+        await self.writer.drain()
+
+    async def send(self, messages, rate):
+        """Sends messages, rate per second or as fast as possible if 0."""
+        interval = 1 / rate if rate else 0
+        for _ in range(messages):
+            text = str(time.perf_counter_ns())
+            msg = CDProto.message(text, self.channel)
+            self.writer.write(CDProto.encode_msg(msg, self.wire))
+            self.stats.sent += 1
+            if interval:
+                await asyncio.sleep(interval)
+            else:
+                await self.writer.drain()
+
+    async def receive(self):
+        while True:
+            data = await self.reader.read(2**16)
+            if not data:
+                return
+            self.decoder.feed(data)
+            now = time.perf_counter_ns()
+            for msg in self.decoder:
+                if type(msg) == TextMessage:
+                    self.stats.received(now - int(msg.message))
+                elif type(msg) == PingMessage:
+                    self.writer.write(CDProto.encode_msg(CDProto.pong(), self.wire))
+
+    def close(self):
+        self.writer.close()
+
+
+class Stats:
+    """Counters and latency samples of a benchmark run."""
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.sent = 0
+        self.delivered = 0
+        self.latencies = []
+        self.done = asyncio.Event()
+
+    def received(self, latency_ns):
+        self.delivered += 1
+        self.latencies.append(latency_ns)
+        if self.delivered >= self.expected:
+            self.done.set()
+
+    def percentile(self, pct):
+        """Latency percentile in milliseconds."""
+        if not self.latencies:
+            return float("nan")
+        cuts = statistics.quantiles(self.latencies, n=100, method="inclusive")
+        return cuts[pct - 1] / 1e6
+
+
+def cpu_seconds(pid):
+    """User plus system CPU seconds used so far by process pid (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def run(args):
+    channels = [f"#bench-{idx}" for idx in range(args.channels)]
+    members = [args.clients // args.channels] * args.channels
+    for idx in range(args.clients % args.channels):
+        members[idx] += 1
+    senders = min(args.senders, args.clients)
+    # every message is delivered to all the members of its channel, sender included
+    expected = sum(members[idx % args.channels] for idx in range(senders))
+    stats = Stats(expected * args.messages)
+
+    clients = [
+        BenchClient(f"bench{idx}", channels[idx % args.channels], args.wire, stats)
+        for idx in range(args.clients)
+    ]
+    for client in clients:
+        await client.connect(args.host, args.port)
+    receivers = [asyncio.create_task(client.receive()) for client in clients]
+    # let the server process every join before the first message
+    await asyncio.sleep(args.settle)
+
+    cpu_start = cpu_seconds(args.server_pid) if args.server_pid else None
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(client.send(args.messages, args.rate) for client in clients[:senders])
+    )
+    try:
+        await asyncio.wait_for(stats.done.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+    cpu_end = cpu_seconds(args.server_pid) if args.server_pid else None
+
+    for client in clients:
+        client.close()
+    for receiver in receivers:
+        receiver.cancel()
+
+    print(f"clients {args.clients}, channels {args.channels}, senders {senders}")
+    print(f"sent      {stats.sent} msgs, {stats.sent / elapsed:.0f} msgs/s")
+    print(
+        f"delivered {stats.delivered}/{stats.expected} msgs, "
+        f"{stats.delivered / elapsed:.0f} msgs/s"
+    )
+    print(
+        f"latency   p50 {stats.percentile(50):.2f} ms, "
+        f"p99 {stats.percentile(99):.2f} ms"
+    )
+    if cpu_start is not None and cpu_end is not None and stats.delivered:
+        cpu = cpu_end - cpu_start
+        print(
+            f"server    {cpu:.2f} CPU s, "
+            f"{cpu * 1e6 / stats.delivered:.1f} CPU us per delivered msg"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5010)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--senders", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=1000, help="per sender")
+    parser.add_argument("--rate", type=float, default=0, help="msgs/s per sender")
+    parser.add_argument("--wire", choices=[JSON, BINARY], default=JSON)
+    parser.add_argument("--settle", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--server-pid", type=int, help="measure CPU of this server")
+    parser.add_argument(
+        "--spawn",
+        metavar="ARGS",
+        help='start "server.py ARGS" for the run, e.g. --spawn "--engine asyncio"',
+    )
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < args.clients + 64:
+        soft = min(hard, args.clients + 64)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    server = None
+    if args.spawn is not None:
+        server = subprocess.Popen(
+            [sys.executable, "server.py", "--host", args.host, "--port", str(args.port)]
+            + shlex.split(args.spawn)
+        )
+        args.server_pid = server.pid
+        time.sleep(1)
+    try:
+        asyncio.run(run(args))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Scripted chat client, sending the lines of a file or pipe as fast as possible.
+
+Lines are read as typed in the interactive client: "/join #channel" moves to
+a channel and anything else is a message to it.
+"""
+import argparse
+import fcntl
+import sys
+import time
+
+from src import client
+from src.client import Client
+from src.protocol import BINARY, JSON
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("script", nargs="?", default="-", help="file, - for stdin")
+    parser.add_argument("--name", default="Bot")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5010)
+    parser.add_argument("--wire", choices=[JSON, BINARY], default=JSON)
+    parser.add_argument(
+        "--linger",
+        type=float,
+        default=1,
+        help="seconds to keep reading after the last message arrived",
+    )
+    parser.add_argument(
+        "--quiet",
+        default=False,
+        action="store_true",
+        help="count the messages received instead of printing them",
+    )
+    args = parser.parse_args()
+
+    if args.script == "-":
+        # the interactive client made stdin non-blocking
+        fcntl.fcntl(sys.stdin, fcntl.F_SETFL, client.orig_fl)
+        script = sys.stdin
+    else:
+        script = open(args.script, encoding="UTF-8")
+
+    c = Client(args.name, args.host, args.port, args.wire, args.quiet)
+    c.connect()
+    start = time.perf_counter()
+    sent = c.replay(script)
+    elapsed = time.perf_counter() - start
+    c.drain(args.linger)
+    print(
+        f"sent {sent} lines in {elapsed:.2f} s, {sent / (elapsed or 1):.0f} lines/s, "
+        f"received {c.received} messages",
+        file=sys.stderr,
+    )
@@ -1,6 +1,153 @@
+import argparse
+import logging
+import multiprocessing
+import signal
+
+from src.log import setup_logging
 from src.server import Server
 
+
+def run(args, worker=None):
+    """Runs a server engine, as one of args.workers processes if worker is set."""
+    setup_logging(
+        level=getattr(logging, args.log_level),
+        queued=args.log_queue,
+        sample=args.log_sample,
+    )
+
+    bus = None
+    if worker is not None:
+        from src.bus import ChannelBus
+
+        bus = ChannelBus(args.port, worker, args.workers)
+
+    cluster = None
+    if args.cluster:
+        from src.cluster import Cluster
+
+        cluster = Cluster(args.node, args.cluster)
+
+    if args.engine == "asyncio":
+        from src.aio_server import AsyncServer
+
+        if args.uvloop:
+            import uvloop
+
+            uvloop.install()
+        s = AsyncServer(
+            args.host,
+            args.port,
+            bus=bus,
+            reuse_port=bus is not None,
+            history=args.history,
+            stats_port=args.stats_port,
+            cluster=cluster,
+            idle_timeout=args.idle_timeout,
+        )
+    else:
+        s = Server(
+            args.host,
+            args.port,
+            bus=bus,
+            reuse_port=bus is not None,
+            flush_interval=args.flush_interval,
+            flush_frames=args.flush_frames,
+            history=args.history,
+            stats_port=args.stats_port,
+            cluster=cluster,
+            idle_timeout=args.idle_timeout,
+        )
+
+    try:
+        s.loop()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if bus:
+            bus.close()
+        if cluster:
+            cluster.close()
+
+
 if __name__ == "__main__":
-    s = Server()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5010)
+    parser.add_argument(
+        "--engine", choices=["selectors", "asyncio"], default="selectors"
+    )
+    parser.add_argument("--uvloop", default=False, action="store_true")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--flush-interval",
+        type=float,
+        default=0,
+        help="seconds to coalesce frames per client (selectors engine)",
+    )
+    parser.add_argument("--flush-frames", type=int, default=64)
+    parser.add_argument(
+        "--stats-port",
+        type=int,
+        help="serve statistics as JSON over HTTP on this local port",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        default="DEBUG",
+    )
+    parser.add_argument(
+        "--log-queue",
+        default=False,
+        action="store_true",
+        help="write server.log from a background thread",
+    )
+    parser.add_argument(
+        "--log-sample",
+        type=int,
+        default=1,
+        help="keep one in every N debug records of each event",
+    )
+    parser.add_argument(
+        "--history",
+        type=int,
+        default=0,
+        help="messages of each channel replayed to the users joining it",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=0,
+        help="seconds of silence before pinging a client, and then reaping it",
+    )
+    parser.add_argument(
+        "--cluster",
+        nargs="+",
+        metavar="HOST:PORT",
+        help="nodes sharding the channels, as the addresses linking them",
+    )
+    parser.add_argument(
+        "--node", metavar="HOST:PORT", help="address of this node in --cluster"
+    )
+    args = parser.parse_args()
+    if args.cluster and (args.node is None or args.workers > 1):
+        parser.error("--cluster needs --node and a single worker")
 
-    s.loop()
+    if args.workers > 1:
+        workers = [
+            multiprocessing.Process(target=run, args=(args, worker))
+            for worker in range(args.workers)
+        ]
+        # stop the workers along with the parent process
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for worker in workers:
+                worker.terminate()
+    else:
+        run(args)
@@ -0,0 +1,155 @@
+"""CD Chat server program on top of asyncio."""
+import asyncio
+import logging
+
+from .base import BaseServer, DISCONNECT, DROP
+from .metrics import http_response
+from .protocol import CDProtoBadFormat, CDProtoDecoder
+
+
+class ChatProtocol(asyncio.Protocol):
+    """Connection of a client to the AsyncServer."""
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.decoder = CDProtoDecoder()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        logging.debug(
+            "Server %s accepts conn from %s",
+            self.server.address,
+            transport.get_extra_info("peername"),
+        )
+
+    def data_received(self, data):
+        self.decoder.feed(data)
+        if self.server.timers:
+            self.server.active.add(self)
+        try:
+            for msg in self.decoder:
+                self.server.handle(self, msg)
+                if self.transport.is_closing():
+                    return
+        except CDProtoBadFormat:
+            logging.debug(
+                "Server %s receives bad frame from %s", self.server.address, self
+            )
+            self.server.unregister_user(self)
+
+    def connection_lost(self, exc):
+        if self in self.server.connections:
+            self.server.unregister_user(self)
+
+
+class AsyncServer(BaseServer):
+    """Chat Server process running on an asyncio event loop."""
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 5010,
+        high_water: int = 2**20,
+        slow_policy: str = DISCONNECT,
+        bus=None,
+        reuse_port: bool = False,
+        history: int = 0,
+        history_bytes: int = 2**16,
+        stats_port: int = None,
+        cluster=None,
+        idle_timeout: float = 0,
+    ):
+        """Initializes Server process, the socket is bound by start."""
+        super().__init__(
+            host,
+            port,
+            high_water,
+            slow_policy,
+            bus,
+            history,
+            history_bytes,
+            stats_port,
+            cluster,
+            idle_timeout,
+        )
+        self.reuse_port = reuse_port
+        self.connections = set()
+        self.listener = None
+
+    def connect(self) -> ChatProtocol:
+        conn = ChatProtocol(self)
+        self.connections.add(conn)
+        self.watch(conn)
+        return conn
+
+    async def start(self):
+        """Binds the server socket in the running event loop."""
+        loop = asyncio.get_running_loop()
+        self.listener = await loop.create_server(
+            self.connect, *self.address, backlog=100, reuse_port=self.reuse_port
+        )
+        if self.bus:
+            loop.add_reader(self.bus.socket, self.relay)
+        if self.stats_port is not None:
+            await asyncio.start_server(self.serve_stats, "localhost", self.stats_port)
+        if self.cluster:
+            self.link_cluster()
+        if self.timers:
+            loop.call_later(self.timers.tick, self.tick)
+        logging.debug("Server %s initialized", self.address)
+
+    def tick(self):
+        """Runs the idle timers every tick of their wheel."""
+        self.reap_idle()
+        loop = asyncio.get_running_loop()
+        loop.call_later(max(0, self.timers.next_tick - loop.time()), self.tick)
+
+    def queue(self, conn, frame) -> bool:
+        """Buffers a frame in the transport, False if conn must be disconnected."""
+        transport = conn.transport
+        if transport.get_write_buffer_size() + len(frame) > self.high_water:
+            logging.debug("Server %s finds slow conn %s", self.address, conn)
+            return self.slow_policy == DROP
+        transport.write(frame)
+        return True
+
+    async def serve_stats(self, reader, writer):
+        """Answers any request with the statistics and closes the connection."""
+        await reader.read(4096)
+        writer.write(http_response(self.snapshot()))
+        await writer.drain()
+        writer.close()
+
+    def add_reader(self, sock, callback):
+        asyncio.get_running_loop().add_reader(sock, callback, sock)
+
+    def remove_reader(self, sock):
+        asyncio.get_running_loop().remove_reader(sock)
+
+    def connection_count(self) -> int:
+        return len(self.connections)
+
+    def pending_bytes(self) -> int:
+        return sum(
+            conn.transport.get_write_buffer_size() for conn in self.connections
+        )
+
+    def set_wire(self, conn, wire):
+        conn.decoder.wire = wire
+
+    def unregister_user(self, conn):
+        self.connections.discard(conn)
+        user = self.forget_user(conn)
+        conn.transport.abort()
+        logging.debug("Server %s unregisters user %s", self.address, user)
+
+    async def serve(self):
+        await self.start()
+        logging.debug("Server %s enters loop", self.address)
+        async with self.listener:
+            await self.listener.serve_forever()
+
+    def loop(self):
+        """Loop indefinetely."""
+        asyncio.run(self.serve())
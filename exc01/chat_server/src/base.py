@@ -0,0 +1,315 @@
+"""Chat state shared by the CD Chat server engines."""
+import heapq
+import logging
+import time
+from abc import ABC, abstractmethod
+
+from .history import History
+from .metrics import Stats
+from .protocol import (
+    BINARY,
+    JSON,
+    CDProto,
+    CDProtoBadFormat,
+    Frames,
+    JoinMessage,
+    PingMessage,
+    PongMessage,
+    RegisterMessage,
+    TextMessage,
+)
+from .timers import TimerWheel
+
+MAIN_CHANNEL = -1
+
+# What to do with a client whose outbound buffer exceeds the high-water mark
+DROP = "drop"
+DISCONNECT = "disconnect"
+
+# Resolution of the idle timers, in ticks per idle timeout
+IDLE_TICKS = 32
+
+
+class BaseServer(ABC):
+    """Users and channels of a chat server, independent of its event loop."""
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 5010,
+        high_water: int = 2**20,
+        slow_policy: str = DISCONNECT,
+        bus=None,
+        history: int = 0,
+        history_bytes: int = 2**16,
+        stats_port: int = None,
+        cluster=None,
+        idle_timeout: float = 0,
+    ):
+        """Initializes chat state.
+
+        Parameters:
+            high_water: maximum bytes pending to be sent to a client
+            slow_policy: DROP new messages or DISCONNECT a client above high_water
+            bus: ChannelBus to the other workers sharing the port, if any
+            history: messages of each channel replayed on join, 0 disables it
+            history_bytes: maximum bytes of the history of each channel
+            stats_port: local port serving the statistics, None disables them
+            cluster: Cluster sharding the channels with the other nodes, if any
+            idle_timeout: seconds of silence before a client is pinged, and then
+                before it is disconnected if it does not answer, 0 disables it
+        """
+        self.address = (host, port)
+        self.high_water = high_water
+        self.slow_policy = slow_policy
+        self.bus = bus
+        self.users = dict()
+        # channel -> connections of its members, and connection -> its channel
+        self.channels = {MAIN_CHANNEL: set()}
+        self.user_channel = dict()
+        # connections that negotiated a wire format other than JSON
+        self.wires = dict()
+        self.history_size = history
+        self.history_bytes = history_bytes
+        self.history = dict()
+        self.stats_port = stats_port
+        self.stats = Stats() if stats_port is not None else None
+        self.cluster = cluster
+        self.idle_timeout = idle_timeout
+        self.timers = None
+        if idle_timeout:
+            self.timers = TimerWheel(idle_timeout / IDLE_TICKS, 2 * IDLE_TICKS)
+        # connections heard from since their timer was set, and the ones pinged
+        self.active = set()
+        self.pinged = set()
+        self.ping = Frames(CDProto.ping())
+
+    @abstractmethod
+    def queue(self, conn, frame: bytes) -> bool:
+        """Sends or buffers a frame, returns False if conn must be disconnected."""
+
+    @abstractmethod
+    def unregister_user(self, conn):
+        """Forgets the user of conn and closes the connection."""
+
+    @abstractmethod
+    def set_wire(self, conn, wire: str):
+        """Decodes the next frames received from conn in the wire format."""
+
+    @abstractmethod
+    def add_reader(self, sock, callback):
+        """Calls callback(sock) whenever sock has data to read."""
+
+    @abstractmethod
+    def remove_reader(self, sock):
+        """Stops watching sock."""
+
+    @abstractmethod
+    def connection_count(self) -> int:
+        """Number of open client connections."""
+
+    @abstractmethod
+    def pending_bytes(self) -> int:
+        """Bytes queued to clients but not yet sent."""
+
+    def handle(self, conn, msg):
+        """Processes a message received from conn."""
+        logging.debug("Server %s receives msg %s from conn %s", self.address, msg, conn)
+
+        if not msg:
+            self.unregister_user(conn)
+            return
+        stats = self.stats
+        if stats:
+            start = time.perf_counter_ns()
+
+        type_msg = type(msg)
+        if type_msg == RegisterMessage:
+            self.register_user(conn, msg.user, msg.wire)
+        elif type_msg == JoinMessage:
+            self.join_channel(conn, msg.channel)
+        elif type_msg == TextMessage:
+            channel = msg.channel
+            if channel is None:
+                channel = MAIN_CHANNEL
+            self.send_text(channel, msg.message)
+        elif type_msg == PingMessage:
+            pong = CDProto.encode_msg(CDProto.pong(), self.wires.get(conn, JSON))
+            if not self.queue(conn, pong):
+                self.unregister_user(conn)
+        elif type_msg == PongMessage:
+            pass
+        else:
+            raise CDProtoBadFormat()
+
+        if stats:
+            stats.messages_in += 1
+            stats.latency_us.observe((time.perf_counter_ns() - start) // 1000)
+
+    def register_user(self, conn, username, wire=None):
+        self.users[conn] = username
+        self.channels[MAIN_CHANNEL].add(conn)
+        self.user_channel[conn] = MAIN_CHANNEL
+        if wire == BINARY:
+            self.wires[conn] = wire
+            self.set_wire(conn, wire)
+        logging.debug(
+            "Server %s registers user %s in main channel", self.address, username
+        )
+
+    def forget_user(self, conn):
+        """Removes conn from users and channels, returns its username."""
+        user = self.users.pop(conn, None)
+        self.wires.pop(conn, None)
+        if self.timers:
+            self.timers.cancel(conn)
+            self.active.discard(conn)
+            self.pinged.discard(conn)
+        self.leave_channel(conn)
+        return user
+
+    def leave_channel(self, conn):
+        """Removes conn from its channel, dropping the channel once it is empty."""
+        channel = self.user_channel.pop(conn, None)
+        if channel is None:
+            return
+        members = self.channels[channel]
+        members.discard(conn)
+        if not members and channel != MAIN_CHANNEL:
+            del self.channels[channel]
+            self.history.pop(channel, None)
+            if self.cluster:
+                self.cluster.unsubscribe(channel)
+
+    def join_channel(self, conn, new_channel):
+        username = self.users[conn]
+
+        if self.user_channel.get(conn) != new_channel:
+            self.leave_channel(conn)
+            members = self.channels.get(new_channel)
+            if members is None:
+                members = self.channels[new_channel] = set()
+                if self.cluster:
+                    self.cluster.subscribe(new_channel)
+            members.add(conn)
+            self.user_channel[conn] = new_channel
+
+        logging.debug("Server registers user %s in channel %s", username, new_channel)
+
+        wire = self.wires.get(conn)
+        frame = b""
+        if wire:
+            # binary texts carry no channel, tell the client where they come from
+            frame = CDProto.encode_msg(CDProto.join(new_channel), wire)
+        history = self.history.get(new_channel)
+        if history:
+            frame += history.replay(wire or JSON)
+        if frame and not self.queue(conn, frame):
+            self.unregister_user(conn)
+
+    def send_text(self, channel, text):
+        if self.channels.get(channel) or self.bus or self.cluster:
+            frames = Frames(CDProto.message(text, channel))
+            self.fanout(channel, frames)
+            if self.bus:
+                self.bus.publish(channel, frames.get(JSON))
+            if self.cluster:
+                self.cluster.publish(channel, frames.get(JSON))
+
+        logging.debug(
+            "Server %s sends message %s in channel %s", self.address, text, channel
+        )
+
+    def fanout(self, channel, frames: Frames):
+        """Queues a message to the local members of channel, in their wire format."""
+        if self.history_size and channel in self.channels:
+            history = self.history.get(channel)
+            if history is None:
+                history = self.history[channel] = History(
+                    self.history_size, self.history_bytes
+                )
+            history.append(frames)
+
+        conns = self.channels.get(channel)
+        if conns:
+            if self.stats:
+                self.stats.messages_out += len(conns)
+                self.stats.fanout.observe(len(conns))
+            wires = self.wires
+            slow = [
+                conn
+                for conn in conns
+                if not self.queue(conn, frames.get(wires.get(conn, JSON)))
+            ]
+            for conn in slow:
+                self.unregister_user(conn)
+
+    def relay(self, sock=None):
+        """Delivers the frames published by the other workers on the bus."""
+        received = self.bus.recv()
+        while received is not None:
+            channel, frame = received
+            self.fanout(channel, Frames(json=frame))
+            received = self.bus.recv()
+
+    def watch(self, conn):
+        """Starts the idle timer of a new connection."""
+        if self.timers:
+            self.timers.schedule(conn, self.idle_timeout)
+
+    def reap_idle(self, now: float = None):
+        """Pings the connections that went silent, disconnects the ones pinged.
+
+        A connection is pinged after being idle from one to two idle timeouts
+        and disconnected if it stays silent for another idle timeout.
+        """
+        for conn in self.timers.expire(now):
+            if conn in self.active:
+                self.active.discard(conn)
+                self.pinged.discard(conn)
+            elif conn in self.pinged:
+                logging.debug("Server %s reaps idle conn %s", self.address, conn)
+                self.unregister_user(conn)
+                continue
+            else:
+                self.pinged.add(conn)
+                if not self.queue(conn, self.ping.get(self.wires.get(conn, JSON))):
+                    self.unregister_user(conn)
+                    continue
+            self.timers.schedule(conn, self.idle_timeout)
+
+    def link_cluster(self):
+        """Links this node to the others, the main channel is always subscribed."""
+        self.cluster.local.add(MAIN_CHANNEL)
+        self.add_reader(self.cluster.socket, self.accept_peer)
+        self.cluster.start()
+
+    def accept_peer(self, sock):
+        self.add_reader(self.cluster.accept(), self.relay_peer)
+
+    def relay_peer(self, sock):
+        """Delivers the frames forwarded by another node of the cluster."""
+        delivered = self.cluster.recv(sock)
+        if delivered is None:
+            self.remove_reader(sock)
+            self.cluster.close_inbound(sock)
+            return
+        for channel, frame in delivered:
+            self.fanout(channel, Frames(json=frame))
+
+    def snapshot(self) -> dict:
+        """Statistics of the server, rates are measured since the last snapshot."""
+        stats = self.stats
+        hot = heapq.nlargest(5, self.channels.items(), key=lambda item: len(item[1]))
+        return {
+            "uptime": time.monotonic() - stats.started,
+            "connections": self.connection_count(),
+            "users": len(self.users),
+            "channels": len(self.channels),
+            "pending_bytes": self.pending_bytes(),
+            "messages": {"in": stats.messages_in, "out": stats.messages_out},
+            "rates": stats.rates(),
+            "fanout": stats.fanout.as_dict(),
+            "latency_us": stats.latency_us.as_dict(),
+            "hot_channels": {str(channel): len(conns) for channel, conns in hot},
+        }
@@ -0,0 +1,62 @@
+"""Bus relaying channel messages among the worker processes of a chat server."""
+import json
+import logging
+import os
+import socket
+import tempfile
+
+ENCODING = "UTF-8"
+# Unix datagrams carry a whole frame plus the channel header
+MAX_DATAGRAM = 2**17
+
+
+class ChannelBus:
+    """Unix datagram sockets connecting the workers listening on one port."""
+
+    def __init__(self, port: int, worker: int, workers: int, directory: str = None):
+        """Binds the socket of worker.
+
+        Parameters:
+            port: port shared by the workers, names the bus
+            worker: index of this worker, from 0 to workers - 1
+            workers: number of worker processes
+            directory: where the socket files live, defaults to the temp dir
+        """
+        directory = directory or tempfile.gettempdir()
+        paths = [
+            os.path.join(directory, f"cdchat-{port}-{idx}.sock")
+            for idx in range(workers)
+        ]
+        self.path = paths[worker]
+        self.peers = paths[:worker] + paths[worker + 1 :]
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(self.path)
+        self.socket.setblocking(False)
+
+    def publish(self, channel, frame: bytes):
+        """Sends an encoded frame of channel to every other worker."""
+        header = json.dumps(channel).encode(ENCODING)
+        prefix = len(header).to_bytes(2, "big") + header
+        for peer in self.peers:
+            try:
+                self.socket.sendmsg([prefix, frame], [], 0, peer)
+            except (BlockingIOError, FileNotFoundError, ConnectionRefusedError):
+                # peer is not up yet or lagging behind, the message is lost for it
+                logging.debug("Bus %s drops frame to %s", self.path, peer)
+
+    def recv(self):
+        """Retrieves a (channel, frame) pair, None if there is nothing to read."""
+        try:
+            datagram = self.socket.recv(MAX_DATAGRAM)
+        except BlockingIOError:
+            return None
+        size = int.from_bytes(datagram[:2], "big")
+        return json.loads(datagram[2 : 2 + size]), datagram[2 + size :]
+
+    def close(self):
+        self.socket.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
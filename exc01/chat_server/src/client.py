@@ -3,11 +3,19 @@ import logging
 import sys
 
 import socket
+import select
 import selectors
 import fcntl
 import os
 
-from .protocol import CDProto, CDProtoBadFormat, TextMessage
+from .protocol import (
+    JSON,
+    CDProto,
+    CDProtoBadFormat,
+    CDProtoDecoder,
+    PingMessage,
+    TextMessage,
+)
 
 logging.basicConfig(filename=f"{sys.argv[0]}.log", level=logging.DEBUG)
 
@@ -19,12 +27,26 @@ class Client:
     """Chat Client process."""
 
     def __init__(
-        self, name: str = "Foo", server_host: str = "localhost", server_port: int = 5010
+        self,
+        name: str = "Foo",
+        server_host: str = "localhost",
+        server_port: int = 5010,
+        wire: str = JSON,
+        quiet: bool = False,
     ):
-        """Initializes chat client."""
+        """Initializes chat client.
+
+        Parameters:
+            wire: format of the frames asked to the server
+            quiet: count the received messages without printing them
+        """
         self.name = name
         self.server = (server_host, server_port)
         self.channel = None
+        self.wire = wire
+        self.quiet = quiet
+        self.received = 0
+        self.decoder = CDProtoDecoder()
 
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
@@ -38,56 +60,124 @@ class Client:
         self.socket.connect(self.server)
         self.selector.register(self.socket, selectors.EVENT_READ, self.read)
 
-        CDProto.send_msg(self.socket, CDProto.register(self.name))
+        if self.wire == JSON:
+            CDProto.send_msg(self.socket, CDProto.register(self.name))
+        else:
+            CDProto.send_msg(self.socket, CDProto.register(self.name, self.wire))
+            self.decoder.wire = self.wire
+        self.socket.setblocking(False)
 
         logging.debug("Client %s connected to server %s", self.name, self.server)
 
     def read(self, conn):
         logging.debug("Client %s reads socket", self.name)
 
-        msg = CDProto.recv_msg(self.socket)
-
-        if type(msg) == TextMessage:
-            print(msg.message)
-
-            logging.debug(
-                "Client %s receives message %s in channel %s",
-                self.name,
-                msg.message,
-                self.channel,
-            )
+        try:
+            if not self.decoder.fill(self.socket):
+                self.selector.unregister(self.socket)
+                return
+        except BlockingIOError:
+            return
+
+        # print everything that arrived at once rather than line by line
+        lines = []
+        for msg in self.decoder:
+            if type(msg) == TextMessage:
+                lines.append(msg.message)
+
+                logging.debug(
+                    "Client %s receives message %s in channel %s",
+                    self.name,
+                    msg.message,
+                    self.channel,
+                )
+            elif type(msg) == PingMessage:
+                CDProto.send_msg(self.socket, CDProto.pong(), self.wire)
+        if lines and not self.quiet:
+            lines.append("")
+            sys.stdout.write("\n".join(lines))
+            sys.stdout.flush()
+        self.received += len(lines)
 
     def write_user(self, conn):
 
         logging.debug("Client %s keyboard input", self.name)
 
+        # every line typed so far goes out in a single write
+        pending = bytearray()
         for line in conn:
             line = line.rstrip()
             if line == "exit":
+                self.send_all(pending)
                 self.exit()
-            args = line.split()
-            if args[0] == "/join":
-                self.join_channel(args[1])
-            else:
-                self.send_text(" ".join(args))
+            pending += self.encode_line(line)
+        self.send_all(pending)
+
+    def encode_line(self, line: str) -> bytes:
+        """Encodes a line of the user, a /join command or a text."""
+        args = line.split()
+        if not args:
+            return b""
+        if args[0] == "/join":
+            self.channel = args[1]
+            return CDProto.encode_msg(CDProto.join(self.channel), self.wire)
+        msg = CDProto.message(" ".join(args), self.channel)
+        return CDProto.encode_msg(msg, self.wire)
+
+    def send_all(self, data: bytes):
+        """Sends data, reading what arrives meanwhile so neither end stalls."""
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[self.socket.send(view) :]
+            except BlockingIOError:
+                readable, _, _ = select.select([self.socket], [self.socket], [])
+                if readable:
+                    self.read(self.socket)
+
+    def replay(self, lines, batch: int = 2**16):
+        """Sends the lines of a script or pipe as fast as the server takes them.
+
+        Lines are encoded as typed by the user and pipelined, in writes of about
+        batch bytes.
+        """
+        pending = bytearray()
+        sent = 0
+        for line in lines:
+            pending += self.encode_line(line)
+            sent += 1
+            if len(pending) >= batch:
+                self.send_all(pending)
+                pending.clear()
+        self.send_all(pending)
+
+        logging.debug("Client %s replays %d lines", self.name, sent)
+        return sent
+
+    def drain(self, timeout: float):
+        """Reads the incoming messages until none arrives for timeout seconds."""
+        while select.select([self.socket], [], [], timeout)[0]:
+            self.read(self.socket)
+            if self.socket not in self.selector.get_map():
+                return
 
     def exit(self):
         logging.debug("Client %s is exiting", self.name)
 
-        CDProto.send_msg(self.socket, CDProto.message("", self.channel))
+        CDProto.send_msg(self.socket, CDProto.message("", self.channel), self.wire)
         self.socket.close()
         sys.exit()
 
     def join_channel(self, channel):
         logging.debug("Client %s wants to join channel %s", self.name, self.channel)
         self.channel = channel
-        CDProto.send_msg(self.socket, CDProto.join(self.channel))
+        CDProto.send_msg(self.socket, CDProto.join(self.channel), self.wire)
 
     def send_text(self, text):
         logging.debug(
             "Client %s sends message %s to channel %s", self.name, text, self.channel
         )
-        CDProto.send_msg(self.socket, CDProto.message(text, self.channel))
+        CDProto.send_msg(self.socket, CDProto.message(text, self.channel), self.wire)
 
     def loop(self):
         """Loop indefinetely."""
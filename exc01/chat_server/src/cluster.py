@@ -0,0 +1,219 @@
+"""Links sharding the channels of a chat among several server nodes."""
+import hashlib
+import json
+import logging
+import socket
+from bisect import bisect
+
+ENCODING = "UTF-8"
+
+HELLO = "hello"
+SUB = "sub"
+UNSUB = "unsub"
+PUB = "pub"
+
+
+def parse_node(node: str):
+    """Splits a "host:port" node name into its address."""
+    host, port = node.rsplit(":", 1)
+    return host, int(port)
+
+
+class HashRing:
+    """Consistent hashing of channels onto nodes."""
+
+    def __init__(self, nodes, replicas: int = 64):
+        """Places replicas virtual points of every node on the ring."""
+        points = sorted(
+            (self.hash(f"{node}#{idx}"), node)
+            for node in nodes
+            for idx in range(replicas)
+        )
+        self.points = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode(ENCODING)).digest()[:8], "big")
+
+    def owner(self, channel) -> str:
+        """Node responsible for channel, the first point clockwise of its hash."""
+        idx = bisect(self.points, self.hash(json.dumps(channel)))
+        return self.nodes[idx % len(self.nodes)]
+
+
+class Cluster:
+    """TCP links of a chat node to the other nodes of the cluster.
+
+    Every channel has an owner node. Nodes with local members of a channel
+    subscribe to its owner, forward the messages posted locally to it, and the
+    owner relays them to the other subscribed nodes.
+    """
+
+    def __init__(self, node: str, nodes, replicas: int = 64, timeout: float = 1):
+        """Binds the socket accepting the links of the other nodes.
+
+        Parameters:
+            node: "host:port" name of this node, where its links are accepted
+            nodes: names of every node of the cluster
+            replicas: points of each node on the hash ring
+            timeout: seconds to wait for a peer while connecting or sending
+        """
+        self.node = node
+        self.peers = [peer for peer in nodes if peer != node]
+        self.ring = HashRing(self.peers + [node], replicas)
+        self.timeout = timeout
+        # outbound links, peer -> socket, used to send
+        self.links = dict()
+        # inbound links, socket -> [peer, receive buffer], used to receive
+        self.inbound = dict()
+        # channels with local members, and channels owned here -> subscribed peers
+        self.local = set()
+        self.subscribers = dict()
+
+        self.socket = socket.socket()
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(parse_node(node))
+        self.socket.listen(len(self.peers) + 1)
+        self.socket.setblocking(False)
+
+    def owner(self, channel) -> str:
+        return self.ring.owner(channel)
+
+    def start(self):
+        """Links to the peers already up, the others link to us when they start."""
+        for peer in self.peers:
+            self.connect(peer)
+
+    def connect(self, peer):
+        """Opens the link to peer and resends the subscriptions it owns."""
+        self.drop(peer)
+        try:
+            link = socket.create_connection(parse_node(peer), self.timeout)
+        except OSError:
+            logging.debug("Cluster %s cannot reach %s", self.node, peer)
+            return None
+        self.links[peer] = link
+        self.send(peer, HELLO, self.node)
+        for channel in self.local:
+            if self.owner(channel) == peer:
+                self.send(peer, SUB, channel)
+        return link
+
+    def drop(self, peer):
+        link = self.links.pop(peer, None)
+        if link:
+            link.close()
+
+    def send(self, peer, op, channel, frame: bytes = b""):
+        """Sends a message to peer, it is lost if the peer is down."""
+        link = self.links.get(peer)
+        if link is None and op != HELLO:
+            link = self.connect(peer)
+        if link is None:
+            return
+        header = json.dumps([op, channel]).encode(ENCODING)
+        size = (2 + len(header) + len(frame)).to_bytes(4, "big")
+        try:
+            link.sendall(size + len(header).to_bytes(2, "big") + header + frame)
+        except OSError:
+            logging.debug("Cluster %s drops link to %s", self.node, peer)
+            self.drop(peer)
+
+    def subscribe(self, channel):
+        """Asks the owner of channel, now with local members, for its messages."""
+        self.local.add(channel)
+        owner = self.owner(channel)
+        if owner != self.node:
+            self.send(owner, SUB, channel)
+
+    def unsubscribe(self, channel):
+        self.local.discard(channel)
+        owner = self.owner(channel)
+        if owner != self.node:
+            self.send(owner, UNSUB, channel)
+
+    def publish(self, channel, frame: bytes, origin: str = None):
+        """Forwards a frame posted here, or received from origin, to other nodes."""
+        owner = self.owner(channel)
+        if owner == self.node:
+            for peer in self.subscribers.get(channel, ()):
+                if peer != origin:
+                    self.send(peer, PUB, channel, frame)
+        elif origin is None:
+            self.send(owner, PUB, channel, frame)
+
+    def accept(self):
+        """Accepts the link of a peer, to be read with recv."""
+        sock, _ = self.socket.accept()
+        sock.setblocking(False)
+        self.inbound[sock] = [None, bytearray()]
+        return sock
+
+    def recv(self, sock):
+        """Reads from the link sock the (channel, frame) pairs to deliver locally.
+
+        Returns None once the link is closed, to be released with close_inbound.
+        """
+        state = self.inbound[sock]
+        try:
+            data = sock.recv(2**16)
+        except BlockingIOError:
+            return []
+        except OSError:
+            data = b""
+        if not data:
+            return None
+
+        buffer = state[1]
+        buffer += data
+        delivered = []
+        offset = 0
+        while len(buffer) - offset >= 4:
+            size = int.from_bytes(buffer[offset : offset + 4], "big")
+            end = offset + 4 + size
+            if len(buffer) < end:
+                break
+            header_size = int.from_bytes(buffer[offset + 4 : offset + 6], "big")
+            header_end = offset + 6 + header_size
+            op, channel = json.loads(buffer[offset + 6 : header_end])
+            frame = bytes(buffer[header_end:end])
+            offset = end
+
+            if op == PUB:
+                self.publish(channel, frame, state[0])
+                delivered.append((channel, frame))
+            elif op == SUB:
+                self.subscribers.setdefault(channel, set()).add(state[0])
+            elif op == UNSUB:
+                self.unsubscribe_peer(channel, state[0])
+            elif op == HELLO:
+                # the peer just started, link back unless it was the one answering
+                state[0] = channel
+                if channel not in self.links:
+                    self.connect(channel)
+        del buffer[:offset]
+        return delivered
+
+    def unsubscribe_peer(self, channel, peer):
+        peers = self.subscribers.get(channel)
+        if peers is not None:
+            peers.discard(peer)
+            if not peers:
+                del self.subscribers[channel]
+
+    def close_inbound(self, sock):
+        peer, _ = self.inbound.pop(sock)
+        sock.close()
+        # the peer is gone, so is our link to it
+        self.drop(peer)
+        for channel in list(self.subscribers):
+            self.unsubscribe_peer(channel, peer)
+        logging.debug("Cluster %s loses link from %s", self.node, peer)
+
+    def close(self):
+        for peer in list(self.links):
+            self.drop(peer)
+        for sock in list(self.inbound):
+            sock.close()
+        self.socket.close()
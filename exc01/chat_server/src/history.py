@@ -0,0 +1,52 @@
+"""Recent messages of the chat channels, replayed to the users joining them."""
+from .protocol import Frames
+
+
+class History:
+    """Ring of the last messages of a channel, bounded in count and bytes."""
+
+    def __init__(self, size: int, max_bytes: int):
+        """Preallocates the ring.
+
+        Parameters:
+            size: maximum number of messages kept
+            max_bytes: maximum bytes kept, measured on the encoded frames
+        """
+        self.ring = [None] * size
+        self.sizes = [0] * size
+        self.start = 0
+        self.count = 0
+        self.nbytes = 0
+        self.max_bytes = max_bytes
+
+    def append(self, frames: Frames):
+        """Keeps frames, evicting the oldest messages to make room."""
+        size = frames.size()
+        if size > self.max_bytes:
+            return
+        capacity = len(self.ring)
+        while self.count == capacity or self.nbytes + size > self.max_bytes:
+            self.pop()
+        idx = (self.start + self.count) % capacity
+        self.ring[idx] = frames
+        self.sizes[idx] = size
+        self.count += 1
+        self.nbytes += size
+
+    def pop(self):
+        """Evicts the oldest message."""
+        self.ring[self.start] = None
+        self.nbytes -= self.sizes[self.start]
+        self.start = (self.start + 1) % len(self.ring)
+        self.count -= 1
+
+    def replay(self, wire: str) -> bytes:
+        """Encodes the kept messages, oldest first, into a single buffer."""
+        capacity = len(self.ring)
+        return b"".join(
+            self.ring[(self.start + idx) % capacity].get(wire)
+            for idx in range(self.count)
+        )
+
+    def __len__(self):
+        return self.count
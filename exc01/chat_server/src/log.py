@@ -0,0 +1,56 @@
+"""Logging configuration of the chat server."""
+import atexit
+import logging
+import logging.handlers
+import queue
+
+
+class SampleFilter(logging.Filter):
+    """Lets through one in every rate records of each event.
+
+    Events are told apart by their format string, records above DEBUG
+    always pass.
+    """
+
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = rate
+        self.counts = dict()
+
+    def filter(self, record) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        count = self.counts.get(record.msg, 0)
+        self.counts[record.msg] = count + 1
+        return count % self.rate == 0
+
+
+def setup_logging(
+    filename: str = "server.log",
+    level: int = logging.DEBUG,
+    queued: bool = False,
+    sample: int = 1,
+):
+    """Configures the root logger of the server process.
+
+    Parameters:
+        filename: file the records are written to
+        level: records below level are discarded before being formatted
+        queued: hands the records to a background thread that writes them
+        sample: keeps one in every sample DEBUG records of each event
+    """
+    handler = logging.FileHandler(filename)
+    root = logging.getLogger()
+    root.setLevel(level)
+
+    if queued:
+        records = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(records, handler)
+        listener.start()
+        atexit.register(listener.stop)
+        handler = logging.handlers.QueueHandler(records)
+
+    if sample > 1:
+        # filtered before the record is formatted, also when it is queued
+        handler.addFilter(SampleFilter(sample))
+    root.addHandler(handler)
@@ -0,0 +1,68 @@
+"""Runtime statistics of the chat server, served as JSON over HTTP."""
+import json
+import time
+
+ENCODING = "UTF-8"
+BUCKETS = 32
+
+
+class Histogram:
+    """Counts of observations in power of two buckets."""
+
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value: int):
+        self.buckets[min(value.bit_length(), BUCKETS - 1)] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self) -> dict:
+        """Non empty buckets keyed by their upper bound, plus count and mean."""
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0,
+            "buckets": {
+                f"<{2 ** idx}": count
+                for idx, count in enumerate(self.buckets)
+                if count
+            },
+        }
+
+
+class Stats:
+    """Counters and histograms updated by a chat server while it runs."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.messages_in = 0
+        self.messages_out = 0
+        # recipients per broadcast and microseconds to handle each message
+        self.fanout = Histogram()
+        self.latency_us = Histogram()
+        self.last = (self.started, 0, 0)
+
+    def rates(self) -> dict:
+        """Messages per second since the previous call."""
+        now = time.monotonic()
+        then, messages_in, messages_out = self.last
+        self.last = (now, self.messages_in, self.messages_out)
+        elapsed = (now - then) or 1
+        return {
+            "in": (self.messages_in - messages_in) / elapsed,
+            "out": (self.messages_out - messages_out) / elapsed,
+        }
+
+
+def http_response(body: dict) -> bytes:
+    """Encodes body as the JSON payload of an HTTP response."""
+    payload = json.dumps(body, default=str).encode(ENCODING)
+    header = (
+        "HTTP/1.0 200 OK\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(payload)}\r\n"
+        "Connection: close\r\n\r\n"
+    )
+    return header.encode(ENCODING) + payload
@@ -4,6 +4,19 @@ from datetime import datetime
 from socket import socket
 
 ENCODING = "UTF-8"
+CHUNK_SIZE = 2**16
+
+# Wire formats, negotiated in the register message
+JSON = "json"
+BINARY = "binary"
+
+# Opcodes of the binary format
+OP_JOIN = 1
+OP_TEXT = 2
+OP_PING = 3
+OP_PONG = 4
+
+MAX_FRAME = 2**24
 
 class Message:
     """Message Type."""
@@ -26,12 +39,16 @@ class JoinMessage(Message):
 class RegisterMessage(Message):
     """Message to register username in the server."""
 
-    def __init__(self, command, user):
+    def __init__(self, command, user, wire=None):
         self.user = user
+        self.wire = wire
         super().__init__(command)
 
     def __repr__(self):
-        return json.dumps({"command": self.command, "user": self.user})
+        repr = {"command": self.command, "user": self.user}
+        if self.wire != None:
+            repr["wire"] = self.wire
+        return json.dumps(repr)
 
 
 class TextMessage(Message):
@@ -53,13 +70,27 @@ class TextMessage(Message):
         return json.dumps(repr)
 
 
+class PingMessage(Message):
+    """Message checking that the other end of a connection is alive."""
+
+    def __repr__(self):
+        return json.dumps({"command": self.command})
+
+
+class PongMessage(Message):
+    """Message answering a PingMessage."""
+
+    def __repr__(self):
+        return json.dumps({"command": self.command})
+
+
 class CDProto:
     """Computação Distribuida Protocol."""
 
     @classmethod
-    def register(cls, username: str) -> RegisterMessage:
-        """Creates a RegisterMessage object."""
-        return RegisterMessage("register", username)
+    def register(cls, username: str, wire: str = None) -> RegisterMessage:
+        """Creates a RegisterMessage object, asking for the wire format if given."""
+        return RegisterMessage("register", username, wire)
 
     @classmethod
     def join(cls, channel: str) -> JoinMessage:
@@ -72,11 +103,62 @@ class CDProto:
         return TextMessage("message", message, channel)
 
     @classmethod
-    def send_msg(cls, connection: socket, msg: Message):
-        """Sends through a connection a Message object."""
+    def ping(cls) -> PingMessage:
+        """Creates a PingMessage object."""
+        return PingMessage("ping")
+
+    @classmethod
+    def pong(cls) -> PongMessage:
+        """Creates a PongMessage object."""
+        return PongMessage("pong")
+
+    @classmethod
+    def encode_msg(cls, msg: Message, wire: str = JSON) -> bytes:
+        """Serializes a Message object into a length-prefixed frame."""
+        if wire == BINARY:
+            return CDProtoBinary.encode_msg(msg)
         rawdata = repr(msg).encode(ENCODING)
-        header = len(rawdata).to_bytes(2, "big")
-        connection.send(header + rawdata)
+        return len(rawdata).to_bytes(2, "big") + rawdata
+
+    @classmethod
+    def send_msg(cls, connection: socket, msg: Message, wire: str = JSON):
+        """Sends through a connection a Message object."""
+        connection.send(cls.encode_msg(msg, wire))
+
+    @classmethod
+    def broadcast(cls, connections, msg: Message) -> bytes:
+        """Sends a Message object to several connections, encoding it only once."""
+        frame = cls.encode_msg(msg)
+        for connection in connections:
+            connection.send(frame)
+        return frame
+
+    @classmethod
+    def decode(cls, rawdata: bytes) -> Message:
+        """Builds a Message object from the payload of a frame."""
+        try:
+            msg = json.loads(rawdata)
+
+            command = msg["command"]
+            if command == "register":
+                return CDProto.register(msg["user"], msg.get("wire"))
+            elif command == "join":
+                return CDProto.join(msg["channel"])
+            elif command == "message":
+                if msg["message"] == "":
+                    return None
+                if "channel" in msg:
+                    return CDProto.message(msg["message"], msg["channel"])
+                else:
+                    return CDProto.message(msg["message"])
+            elif command == "ping":
+                return CDProto.ping()
+            elif command == "pong":
+                return CDProto.pong()
+            else:
+                raise CDProtoBadFormat(bytes(rawdata))
+        except (ValueError, KeyError, TypeError):
+            raise CDProtoBadFormat(bytes(rawdata))
 
     @classmethod
     def recv_msg(cls, connection: socket) -> Message:
@@ -84,30 +166,203 @@ class CDProto:
         try:
             size = int.from_bytes(connection.recv(2), "big")
             if size:
-                msg = json.loads(
-                    connection.recv(size).decode(ENCODING)
-                )
-
-                command = msg["command"]
-                if command == "register":
-                    return CDProto.register(msg["user"])
-                elif command == "join":
-                    return CDProto.join(msg["channel"])
-                elif command == "message":
-                    if msg["message"] == "":
-                        return None
-                    if "channel" in msg:
-                        return CDProto.message(msg["message"], msg["channel"])
-                    else:
-                        return CDProto.message(msg["message"])
-                else:
-                    raise CDProtoBadFormat()
+                return cls.decode(connection.recv(size))
             else:
                 return None
         except:
             raise CDProtoBadFormat()
 
 
+class Frames:
+    """Frames of one message, encoded at most once per wire format."""
+
+    def __init__(self, msg: Message = None, **frames):
+        """Keeps msg, or frames already encoded keyed by wire format."""
+        self.msg = msg
+        self.frames = frames
+
+    def get(self, wire: str = JSON) -> bytes:
+        frame = self.frames.get(wire)
+        if frame is None:
+            if self.msg is None:
+                self.msg = CDProto.decode(self.frames[JSON][2:])
+            frame = self.frames[wire] = CDProto.encode_msg(self.msg, wire)
+        return frame
+
+    def size(self) -> int:
+        """Bytes of an already encoded frame, encoding the JSON one if none is."""
+        for frame in self.frames.values():
+            return len(frame)
+        return len(self.get(JSON))
+
+
+class CDProtoDecoder:
+    """Incremental decoder of the length-prefixed frames of a connection."""
+
+    def __init__(self, chunk: bytearray = None):
+        """Initializes decoder.
+
+        Parameters:
+            chunk: reusable receive buffer, may be shared by the decoders that
+                are filled from the same thread
+        """
+        self.chunk = chunk
+        self.buffer = bytearray()
+        self.offset = 0
+        # wire format of the frames to come and, for BINARY, the joined channel
+        self.wire = JSON
+        self.channel = None
+
+    def fill(self, connection: socket) -> int:
+        """Reads whatever is available in a connection, returns 0 on EOF."""
+        if self.chunk is None:
+            self.chunk = bytearray(CHUNK_SIZE)
+        nbytes = connection.recv_into(self.chunk)
+        with memoryview(self.chunk) as view:
+            self.feed(view[:nbytes])
+        return nbytes
+
+    def feed(self, data: bytes):
+        """Appends raw bytes, dropping the frames already consumed."""
+        if self.offset:
+            del self.buffer[: self.offset]
+            self.offset = 0
+        self.buffer += data
+
+    def next_frame(self) -> bytes:
+        """Extracts the payload of the next complete frame, None if incomplete."""
+        if self.wire == BINARY:
+            try:
+                size, start = get_varint(self.buffer, self.offset)
+            except IndexError:
+                return None
+            if size > MAX_FRAME:
+                raise CDProtoBadFormat(bytes(self.buffer[self.offset : start]))
+        else:
+            start = self.offset + 2
+            if len(self.buffer) < start:
+                return None
+            size = int.from_bytes(self.buffer[self.offset : start], "big")
+        end = start + size
+        if len(self.buffer) < end:
+            return None
+        self.offset = end
+        return self.buffer[start:end]
+
+    def __iter__(self):
+        """Decodes every complete frame available in the buffer.
+
+        The wire format is checked before each frame, so it may be switched
+        while iterating, right after the register message.
+        """
+        frame = self.next_frame()
+        while frame is not None:
+            if self.wire == BINARY:
+                msg = CDProtoBinary.decode(frame, self.channel)
+                if type(msg) == JoinMessage:
+                    self.channel = msg.channel
+                yield msg
+            else:
+                yield CDProto.decode(frame)
+            frame = self.next_frame()
+
+
+class CDProtoBinary:
+    """Compact binary encoding of CDProto.
+
+    A frame is a varint length followed by an opcode byte and its fields:
+        OP_JOIN: channel name
+        OP_TEXT: varint timestamp, message
+        OP_PING, OP_PONG: no fields
+    Strings are a varint length followed by UTF-8 bytes. Texts carry no channel,
+    they belong to the channel last joined in the stream: clients send OP_JOIN
+    to move and the server echoes it before the first text of the new channel.
+    """
+
+    @classmethod
+    def encode_msg(cls, msg: Message) -> bytes:
+        """Serializes a Message object into a frame."""
+        payload = bytearray()
+        if type(msg) == JoinMessage:
+            payload.append(OP_JOIN)
+            put_str(payload, str(msg.channel))
+        elif type(msg) == TextMessage:
+            payload.append(OP_TEXT)
+            put_varint(payload, int(datetime.now().timestamp()))
+            put_str(payload, msg.message)
+        elif type(msg) == PingMessage:
+            payload.append(OP_PING)
+        elif type(msg) == PongMessage:
+            payload.append(OP_PONG)
+        else:
+            raise CDProtoBadFormat()
+
+        frame = bytearray()
+        put_varint(frame, len(payload))
+        return bytes(frame + payload)
+
+    @classmethod
+    def decode(cls, rawdata: bytes, channel=None) -> Message:
+        """Builds a Message object from the payload of a frame.
+
+        Parameters:
+            channel: channel last joined in the stream, given to texts
+        """
+        try:
+            opcode = rawdata[0]
+            if opcode == OP_JOIN:
+                name, _ = get_str(rawdata, 1)
+                return CDProto.join(name)
+            elif opcode == OP_TEXT:
+                _, offset = get_varint(rawdata, 1)
+                message, _ = get_str(rawdata, offset)
+                if message == "":
+                    return None
+                return CDProto.message(message, channel)
+            elif opcode == OP_PING:
+                return CDProto.ping()
+            elif opcode == OP_PONG:
+                return CDProto.pong()
+            else:
+                raise CDProtoBadFormat(bytes(rawdata))
+        except (IndexError, ValueError):
+            raise CDProtoBadFormat(bytes(rawdata))
+
+
+def put_varint(buffer: bytearray, value: int):
+    """Appends value as a little-endian base 128 varint."""
+    while value >= 0x80:
+        buffer.append(value & 0x7F | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def get_varint(data: bytes, offset: int):
+    """Reads a varint at offset, returns it along with the offset past it."""
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def put_str(buffer: bytearray, text: str):
+    rawdata = text.encode(ENCODING)
+    put_varint(buffer, len(rawdata))
+    buffer += rawdata
+
+
+def get_str(data: bytes, offset: int):
+    size, offset = get_varint(data, offset)
+    end = offset + size
+    if end > len(data):
+        raise IndexError(end)
+    return bytes(data[offset:end]).decode(ENCODING), end
+
+
 class CDProtoBadFormat(Exception):
     """Exception when source message is not CDProto."""
 
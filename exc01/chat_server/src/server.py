@@ -1,121 +1,263 @@
 """CD Chat server program."""
 import logging
+import os
+import time
 
 import socket
 import selectors
+from collections import deque
+from itertools import islice
 
-logging.basicConfig(filename="server.log", level=logging.DEBUG)
+from .base import BaseServer, DISCONNECT, DROP, MAIN_CHANNEL
+from .metrics import http_response
+from .protocol import CDProtoDecoder
 
-from .protocol import (
-    CDProto,
-    CDProtoBadFormat,
-    JoinMessage,
-    RegisterMessage,
-    TextMessage,
-)
+# most buffers a single sendmsg call accepts
+IOV_MAX = os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") else 1024
 
-MAIN_CHANNEL = -1
 
+class Outbox:
+    """Frames pending to be sent to a connection."""
 
-class Server:
+    def __init__(self):
+        self.frames = deque()
+        self.size = 0
+        # whether the connection is registered for EVENT_WRITE
+        self.writing = False
+
+    def append(self, frame):
+        self.frames.append(frame)
+        self.size += len(frame)
+
+    def send(self, sock) -> int:
+        """Writes as many frames as possible with one sendmsg, returns bytes sent."""
+        frames = self.frames
+        if len(frames) == 1:
+            sent = sock.send(frames[0])
+        else:
+            sent = sock.sendmsg(list(islice(frames, IOV_MAX)))
+        self.size -= sent
+        remaining = sent
+        while remaining:
+            size = len(frames[0])
+            if size > remaining:
+                frames[0] = memoryview(frames[0])[remaining:]
+                break
+            frames.popleft()
+            remaining -= size
+        return sent
+
+
+class Server(BaseServer):
     """Chat Server process."""
 
-    def __init__(self, host: str = "localhost", port: int = 5010):
-        """Initializes Server process."""
-        self.address = (host, port)
-        self.users = dict()
-        self.channels = {MAIN_CHANNEL: set()}
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 5010,
+        high_water: int = 2**20,
+        slow_policy: str = DISCONNECT,
+        bus=None,
+        reuse_port: bool = False,
+        flush_interval: float = 0,
+        flush_frames: int = 64,
+        history: int = 0,
+        history_bytes: int = 2**16,
+        stats_port: int = None,
+        cluster=None,
+        idle_timeout: float = 0,
+    ):
+        """Initializes Server process.
+
+        Parameters:
+            reuse_port: lets several worker processes bind the same port
+            flush_interval: seconds frames may wait to be sent together with the
+                next ones to the same client, 0 sends each frame right away
+            flush_frames: frames pending to a client that trigger a flush
+        """
+        super().__init__(
+            host,
+            port,
+            high_water,
+            slow_policy,
+            bus,
+            history,
+            history_bytes,
+            stats_port,
+            cluster,
+            idle_timeout,
+        )
+        self.flush_interval = flush_interval
+        self.flush_frames = flush_frames
+        self.decoders = dict()
+        self.outbox = dict()
+        # connections with frames waiting for the flush deadline
+        self.dirty = set()
+        self.flush_deadline = None
+        # receive buffer shared by the decoders of all connections
+        self.chunk = bytearray(2**16)
 
         self.socket = socket.socket()
         self.selector = selectors.DefaultSelector()
 
+        if reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.socket.bind((host, port))
         self.socket.listen(100)
         self.selector.register(self.socket, selectors.EVENT_READ, self.accept)
+        if self.bus:
+            self.selector.register(self.bus.socket, selectors.EVENT_READ, self.relay)
+        if stats_port is not None:
+            self.stats_socket = socket.socket()
+            self.stats_socket.bind(("localhost", stats_port))
+            self.stats_socket.listen(10)
+            self.selector.register(
+                self.stats_socket, selectors.EVENT_READ, self.accept_stats
+            )
+        if self.cluster:
+            self.link_cluster()
 
         logging.debug("Server %s initialized", self.address)
 
     def accept(self, sock):
         conn, addr = sock.accept()
         conn.setblocking(False)
+        self.decoders[conn] = CDProtoDecoder(self.chunk)
         self.selector.register(conn, selectors.EVENT_READ, self.read)
+        self.watch(conn)
 
         logging.debug("Server %s accepts conn %s from %s", self.address, conn, addr)
 
     def read(self, conn):
-        msg = CDProto.recv_msg(conn)
-
-        logging.debug("Server %s receives msg %s from conn %s", self.address, msg, conn)
-
-        if msg:
-            type_msg = type(msg)
-            if type_msg == RegisterMessage:
-                self.register_user(conn, msg.user)
-            elif type_msg == JoinMessage:
-                self.join_channel(conn, msg.channel)
-            elif type_msg == TextMessage:
-                channel = msg.channel
-                if channel is None:
-                    channel = MAIN_CHANNEL
-                self.send_text(channel, msg.message)
-            else:
-                raise CDProtoBadFormat()
-        else:
+        decoder = self.decoders.get(conn)
+        if decoder is None:
+            # disconnected earlier in this same batch of events
+            return
+        try:
+            if not decoder.fill(conn):
+                self.unregister_user(conn)
+                return
+        except BlockingIOError:
+            return
+        except ConnectionError:
             self.unregister_user(conn)
+            return
+        if self.timers:
+            self.active.add(conn)
 
-    def register_user(self, sock, username):
-        self.users[sock] = username
-        self.channels[MAIN_CHANNEL].add(username)
-        logging.debug(
-            "Server %s registers user %s in main channel", self.address, username
-        )
+        for msg in decoder:
+            self.handle(conn, msg)
+            if conn not in self.decoders:
+                return
 
-    def unregister_user(self, sock):
-        self.selector.unregister(sock)
-        user = self.users.pop(sock)
-        for channel in self.channels:
-            if user in self.channels[channel]:
-                self.channels[channel].remove(user)
-        for channel in [
-            channel
-            for channel in self.channels
-            if channel == MAIN_CHANNEL or len(self.channels[channel]) > 0
-        ]:
-            if channel not in self.channels:
-                self.channels.pop(channel)
-        sock.close()
-        logging.debug("Server %s unregisters user %s", self.address, user)
+    def queue(self, sock, frame) -> bool:
+        """Sends or buffers a frame, returns False if sock must be disconnected."""
+        outbox = self.outbox.get(sock)
+        if outbox is None:
+            if not self.flush_interval:
+                try:
+                    sent = sock.send(frame)
+                except BlockingIOError:
+                    sent = 0
+                except ConnectionError:
+                    return False
+                if sent == len(frame):
+                    return True
+                frame = memoryview(frame)[sent:]
+            outbox = self.outbox[sock] = Outbox()
+        elif outbox.size + len(frame) > self.high_water:
+            logging.debug("Server %s finds slow conn %s", self.address, sock)
+            return self.slow_policy == DROP
 
-    def join_channel(self, sock, new_channel):
-        username = self.users[sock]
+        outbox.append(frame)
+        if outbox.writing:
+            return True
+        if not self.flush_interval or len(outbox.frames) >= self.flush_frames:
+            return self.send(sock, outbox)
+        if not self.dirty:
+            self.flush_deadline = time.monotonic() + self.flush_interval
+        self.dirty.add(sock)
+        return True
 
-        for channel in self.channels:
-            if username in self.channels[channel]:
-                self.channels[channel].remove(username)
-                break
+    def send(self, sock, outbox: Outbox) -> bool:
+        """Sends the frames of outbox, waits for EVENT_WRITE to send the rest.
 
-        if new_channel not in self.channels:
-            self.channels[new_channel] = set()
-        self.channels[new_channel].add(username)
+        Returns False if sock must be disconnected.
+        """
+        self.dirty.discard(sock)
+        try:
+            outbox.send(sock)
+        except BlockingIOError:
+            pass
+        except ConnectionError:
+            return False
 
-        logging.debug("Server registers user %s in channel %s", username, new_channel)
+        if outbox.size:
+            if not outbox.writing:
+                outbox.writing = True
+                self.selector.modify(
+                    sock, selectors.EVENT_READ | selectors.EVENT_WRITE, self.read
+                )
+        else:
+            del self.outbox[sock]
+            if outbox.writing:
+                self.selector.modify(sock, selectors.EVENT_READ, self.read)
+        return True
 
-    def send_text(self, channel, text):
-        if channel in self.channels:
-            socks = self.get_socks(self.channels[channel])
-            for sock in socks:
-                CDProto.send_msg(sock, CDProto.message(text, channel))
+    def write(self, sock) -> bool:
+        """Flushes the pending frames of sock, returns False if it disconnected."""
+        outbox = self.outbox.get(sock)
+        if outbox is None:
+            return sock in self.decoders
+        if not self.send(sock, outbox):
+            self.unregister_user(sock)
+            return False
+        return True
 
-        logging.debug(
-            "Server %s sends message %s in channel %s", self.address, text, channel
-        )
+    def flush(self):
+        """Sends the frames held back by the flush window."""
+        for sock in list(self.dirty):
+            self.write(sock)
+        self.flush_deadline = None
+
+    def accept_stats(self, sock):
+        conn, _ = sock.accept()
+        conn.setblocking(False)
+        self.selector.register(conn, selectors.EVENT_READ, self.serve_stats)
+
+    def serve_stats(self, conn):
+        """Answers any request with the statistics and closes the connection."""
+        self.selector.unregister(conn)
+        try:
+            conn.recv(4096)
+            conn.send(http_response(self.snapshot()))
+        except OSError:
+            pass
+        conn.close()
+
+    def add_reader(self, sock, callback):
+        self.selector.register(sock, selectors.EVENT_READ, callback)
+
+    def remove_reader(self, sock):
+        self.selector.unregister(sock)
 
-    def get_socks(self, users):
-        socks = set()
-        for sock in self.users:
-            if self.users[sock] in users:
-                socks.add(sock)
-        return socks
+    def connection_count(self) -> int:
+        return len(self.decoders)
+
+    def pending_bytes(self) -> int:
+        return sum(outbox.size for outbox in self.outbox.values())
+
+    def set_wire(self, sock, wire):
+        self.decoders[sock].wire = wire
+
+    def unregister_user(self, sock):
+        self.selector.unregister(sock)
+        self.decoders.pop(sock, None)
+        self.outbox.pop(sock, None)
+        self.dirty.discard(sock)
+        user = self.forget_user(sock)
+        sock.close()
+        logging.debug("Server %s unregisters user %s", self.address, user)
 
     def loop(self):
         """Loop indefinetely."""
@@ -123,6 +265,19 @@ class Server:
         logging.debug("Server %s enters loop", self.address)
 
         while True:
-            for key, mask in self.selector.select():
-                callback = key.data
-                callback(key.fileobj)
+            timeout = None
+            if self.dirty:
+                timeout = max(0, self.flush_deadline - time.monotonic())
+            if self.timers:
+                wait = max(0, self.timers.next_tick - time.monotonic())
+                timeout = wait if timeout is None else min(timeout, wait)
+            for key, mask in self.selector.select(timeout):
+                if mask & selectors.EVENT_WRITE and not self.write(key.fileobj):
+                    continue
+                if mask & selectors.EVENT_READ:
+                    callback = key.data
+                    callback(key.fileobj)
+            if self.dirty and time.monotonic() >= self.flush_deadline:
+                self.flush()
+            if self.timers and time.monotonic() >= self.timers.next_tick:
+                self.reap_idle()
@@ -0,0 +1,48 @@
+"""Timers of the chat server."""
+import math
+import time
+
+
+class TimerWheel:
+    """Hashed timing wheel, scheduling and expiring keys in O(1).
+
+    Time advances in ticks; a key scheduled d seconds ahead is kept in the slot
+    ceil(d / tick) ticks after the current one, so delays must stay shorter
+    than a whole turn of the wheel, tick * slots.
+    """
+
+    def __init__(self, tick: float, slots: int):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.slot_of = dict()
+        self.current = 0
+        self.next_tick = time.monotonic() + tick
+
+    def schedule(self, key, delay: float):
+        """Expires key after delay seconds, replacing its previous schedule."""
+        self.cancel(key)
+        ticks = min(max(1, math.ceil(delay / self.tick)), len(self.slots) - 1)
+        idx = (self.current + ticks) % len(self.slots)
+        self.slots[idx].add(key)
+        self.slot_of[key] = idx
+
+    def cancel(self, key):
+        idx = self.slot_of.pop(key, None)
+        if idx is not None:
+            self.slots[idx].discard(key)
+
+    def expire(self, now: float = None) -> list:
+        """Advances the wheel up to now, returns the keys that expired."""
+        if now is None:
+            now = time.monotonic()
+        expired = []
+        while self.next_tick <= now:
+            self.current = (self.current + 1) % len(self.slots)
+            slot = self.slots[self.current]
+            if slot:
+                for key in slot:
+                    del self.slot_of[key]
+                expired.extend(slot)
+                slot.clear()
+            self.next_tick += self.tick
+        return expired
@@ -0,0 +1,50 @@
+"""Tests for the asyncio server engine."""
+import asyncio
+
+from src.aio_server import AsyncServer
+from src.protocol import CDProto, CDProtoDecoder, TextMessage
+
+
+async def connect(port, name):
+    reader, writer = await asyncio.open_connection("localhost", port)
+    writer.write(CDProto.encode_msg(CDProto.register(name)))
+    return reader, writer
+
+
+async def recv(reader):
+    decoder = CDProtoDecoder()
+    while True:
+        decoder.feed(await reader.read(1024))
+        for msg in decoder:
+            return msg
+
+
+async def chat():
+    s = AsyncServer(port=0)
+    await s.start()
+    port = s.listener.sockets[0].getsockname()[1]
+
+    foo_reader, foo = await connect(port, "foo")
+    bar_reader, bar = await connect(port, "bar")
+    foo.write(CDProto.encode_msg(CDProto.join("#cd")))
+    bar.write(CDProto.encode_msg(CDProto.join("#cd")))
+    await asyncio.sleep(0.1)
+    assert set(s.channels["#cd"]) == set(s.connections)
+
+    foo.write(CDProto.encode_msg(CDProto.message("Hello World", "#cd")))
+    msg = await asyncio.wait_for(recv(bar_reader), 2)
+    assert isinstance(msg, TextMessage)
+    assert msg.message == "Hello World"
+
+    bar.write(CDProto.encode_msg(CDProto.message("", "#cd")))
+    await asyncio.sleep(0.1)
+    assert len(s.connections) == 1
+    assert list(s.users.values()) == ["foo"]
+
+    foo.close()
+    bar.close()
+    s.listener.close()
+
+
+def test_async_server():
+    asyncio.run(chat())
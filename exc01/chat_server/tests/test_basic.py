@@ -92,3 +92,14 @@ def test_channels(foo, bar):
     foo.sendline("Because a vision softly creeping")
     with pytest.raises(pexpect.exceptions.TIMEOUT):
         bar.expect("Because a vision softly creeping", timeout=TIMEOUT)
+
+
+def test_bot(foo, tmp_path):
+    script = tmp_path / "script.txt"
+    script.write_text("".join(f"Message {idx}\n" for idx in range(1000)))
+
+    bot = pexpect.spawnu(f"python3 bot.py --quiet {script}")
+    foo.expect("Message 999", timeout=TIMEOUT)
+    bot.expect("sent 1000 lines", timeout=TIMEOUT * 2)
+    bot.expect("received 1000 messages", timeout=TIMEOUT)
+    bot.close()
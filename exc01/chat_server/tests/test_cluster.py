@@ -0,0 +1,86 @@
+import socket
+
+from src.cluster import Cluster, HashRing
+from src.protocol import CDProto, CDProtoDecoder
+from src.server import MAIN_CHANNEL, Server
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def pump(*servers):
+    """Processes the events pending in the servers until they are all idle."""
+    busy = True
+    while busy:
+        busy = False
+        for s in servers:
+            for key, mask in s.selector.select(0.05):
+                busy = True
+                key.data(key.fileobj)
+
+
+def test_hash_ring():
+    """Test that channels spread over the nodes and stay put when one leaves."""
+    nodes = [f"localhost:{port}" for port in range(6000, 6004)]
+    ring = HashRing(nodes)
+    owners = {channel: ring.owner(channel) for channel in range(-1, 400)}
+    assert set(owners.values()) == set(nodes)
+
+    smaller = HashRing(nodes[:-1])
+    for channel, owner in owners.items():
+        if owner != nodes[-1]:
+            assert smaller.owner(channel) == owner
+
+
+def test_cluster():
+    """Test that users of different nodes talk in the same channels."""
+    nodes = [f"localhost:{free_port()}" for _ in range(2)]
+    a = Server(port=0, cluster=Cluster(nodes[0], nodes))
+    b = Server(port=0, cluster=Cluster(nodes[1], nodes))
+    pump(a, b)
+
+    channels = {node: [] for node in nodes}
+    for idx in range(20):
+        channels[a.cluster.owner(f"#{idx}")].append(f"#{idx}")
+    # a channel owned by each node, and the main channel
+    for channel in [channels[nodes[0]][0], channels[nodes[1]][0], None]:
+        foo, foo_peer = socket.socketpair()
+        bar, bar_peer = socket.socketpair()
+        baz, baz_peer = socket.socketpair()
+        a.register_user(foo, "foo")
+        b.register_user(bar, "bar")
+        b.register_user(baz, "baz")
+        if channel:
+            a.join_channel(foo, channel)
+            b.join_channel(bar, channel)
+        pump(a, b)
+
+        a.send_text(channel or MAIN_CHANNEL, "Hello from a")
+        b.send_text(channel or MAIN_CHANNEL, "Hello from b")
+        pump(a, b)
+
+        for peer in [foo_peer, bar_peer, baz_peer]:
+            peer.setblocking(False)
+            decoder = CDProtoDecoder()
+            try:
+                decoder.fill(peer)
+            except BlockingIOError:
+                pass
+            received = sorted(msg.message for msg in decoder)
+            if channel and peer is baz_peer:
+                assert received == []
+            else:
+                assert received == ["Hello from a", "Hello from b"]
+
+        for s, conn in [(a, foo), (b, bar), (b, baz)]:
+            s.forget_user(conn)
+        pump(a, b)
+
+    # only the main channel keeps subscribers once the users leave
+    assert set(a.cluster.subscribers) | set(b.cluster.subscribers) == {MAIN_CHANNEL}
+
+    a.cluster.close()
+    b.cluster.close()
@@ -1,11 +1,15 @@
 """Tests for the chat protocol."""
 import pytest
 from src.protocol import (
+    BINARY,
     CDProto,
     TextMessage,
     JoinMessage,
+    PingMessage,
+    PongMessage,
     RegisterMessage,
     CDProtoBadFormat,
+    CDProtoDecoder,
 )
 
 from freezegun import freeze_time
@@ -19,6 +23,9 @@ def test_protocol():
 
     assert str(p.join("#cd")) == '{"command": "join", "channel": "#cd"}'
 
+    assert str(p.ping()) == '{"command": "ping"}'
+    assert isinstance(p.decode(repr(p.pong()).encode()), PongMessage)
+
     assert (
         str(p.message("Hello World"))
         == '{"command": "message", "message": "Hello World", "ts": 1615852800}'
@@ -59,3 +66,107 @@ def test_recv():
 
     with pytest.raises(CDProtoBadFormat):
         CDProto.recv_msg(mock_socket(b"Hello World"))
+
+
+class recording_socket:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(data)
+        return len(data)
+
+
+@freeze_time("Mar 16th, 2021")
+def test_broadcast():
+    msg = CDProto.message("Hello World", "#cd")
+    frame = CDProto.encode_msg(msg)
+
+    assert frame[2:] == repr(msg).encode("UTF-8")
+    assert int.from_bytes(frame[:2], "big") == len(frame) - 2
+
+    socks = [recording_socket() for _ in range(3)]
+    assert CDProto.broadcast(socks, msg) == frame
+    assert all(sock.sent == [frame] for sock in socks)
+    assert socks[0].sent[0] is socks[1].sent[0]
+
+
+class chunked_socket:
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+
+    def recv_into(self, buffer):
+        chunk = self.chunks.pop(0)
+        buffer[: len(chunk)] = chunk
+        return len(chunk)
+
+
+def test_decoder():
+    stream = b"".join(
+        CDProto.encode_msg(msg)
+        for msg in (CDProto.register("student"), CDProto.join("#cd"))
+    ) + CDProto.encode_msg(CDProto.message("Hello World"))
+
+    decoder = CDProtoDecoder()
+    sock = chunked_socket(stream[:1], stream[1:60], stream[60:-3], stream[-3:], b"")
+
+    assert decoder.fill(sock) == 1
+    assert list(decoder) == []
+
+    decoder.fill(sock)
+    msgs = list(decoder)
+    assert len(msgs) == 1 and isinstance(msgs[0], RegisterMessage)
+
+    decoder.fill(sock)
+    msgs = list(decoder)
+    assert len(msgs) == 1 and isinstance(msgs[0], JoinMessage)
+
+    decoder.fill(sock)
+    msgs = list(decoder)
+    assert len(msgs) == 1 and msgs[0].message == "Hello World"
+
+    assert decoder.fill(sock) == 0
+
+
+def test_decoder_bad_format():
+    decoder = CDProtoDecoder()
+    decoder.feed(len(b"Hello World").to_bytes(2, "big") + b"Hello World")
+
+    with pytest.raises(CDProtoBadFormat) as exc:
+        list(decoder)
+    assert exc.value.original_msg == "Hello World"
+
+
+def test_binary():
+    decoder = CDProtoDecoder()
+    decoder.wire = BINARY
+
+    stream = b"".join(
+        CDProto.encode_msg(msg, BINARY)
+        for msg in (
+            CDProto.message("Olá Mundo"),
+            CDProto.join("#cd"),
+            CDProto.message("x" * 2**17, "#ignored"),
+            CDProto.message(""),
+        )
+    )
+    for idx in range(0, len(stream), 1000):
+        decoder.feed(stream[idx : idx + 1000])
+    msgs = list(decoder)
+
+    assert isinstance(msgs[0], TextMessage)
+    assert (msgs[0].message, msgs[0].channel) == ("Olá Mundo", None)
+    assert isinstance(msgs[1], JoinMessage) and msgs[1].channel == "#cd"
+    assert (msgs[2].message, msgs[2].channel) == ("x" * 2**17, "#cd")
+    assert msgs[3] is None
+
+    msg = CDProto.message("Hello World", "#cd")
+    heartbeat = (CDProto.ping(), CDProto.pong())
+    assert len(CDProto.encode_msg(msg, BINARY)) < len(CDProto.encode_msg(msg)) / 2
+
+    decoder.feed(b"".join(CDProto.encode_msg(msg, BINARY) for msg in heartbeat))
+    assert [type(msg) for msg in decoder] == [PingMessage, PongMessage]
+
+    decoder.feed(b"\x03\x07ab")
+    with pytest.raises(CDProtoBadFormat):
+        list(decoder)
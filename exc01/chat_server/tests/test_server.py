@@ -1,9 +1,24 @@
+import json
+import logging
+import selectors
+import socket
+
 import pytest
 from unittest.mock import patch
 from mock import MagicMock
 from mockselector.selector import MockSocket, ListenSocket, MockSelector
 
-from src.server import Server
+from src.bus import ChannelBus
+from src.log import SampleFilter
+from src.protocol import (
+    BINARY,
+    JSON,
+    CDProto,
+    CDProtoDecoder,
+    PingMessage,
+    TextMessage,
+)
+from src.server import DISCONNECT, DROP, MAIN_CHANNEL, Server
 
 
 class CDProtoException(Exception):
@@ -31,3 +46,243 @@ def test_server():
 
             with pytest.raises(CDProtoException):
                 s.loop()
+
+
+def test_channel_index():
+    """Test that broadcasts only reach the members of the channel."""
+    s = Server(port=0)
+    foo, foo_peer = socket.socketpair()
+    bar, bar_peer = socket.socketpair()
+    bar_peer.setblocking(False)
+
+    s.register_user(foo, "foo")
+    s.register_user(bar, "bar")
+    assert s.channels[MAIN_CHANNEL] == {foo, bar}
+
+    s.join_channel(foo, "#cd")
+    assert s.channels[MAIN_CHANNEL] == {bar}
+    assert s.channels["#cd"] == {foo}
+    assert s.user_channel == {foo: "#cd", bar: MAIN_CHANNEL}
+
+    s.send_text("#cd", "Hello")
+    assert isinstance(CDProto.recv_msg(foo_peer), TextMessage)
+    with pytest.raises(BlockingIOError):
+        bar_peer.recv(1)
+
+
+@pytest.mark.parametrize("policy", [DROP, DISCONNECT])
+def test_slow_consumer(policy):
+    """Test that a client that does not read is dropped or disconnected."""
+    s = Server(port=0, high_water=2**16, slow_policy=policy)
+    slow, slow_peer = socket.socketpair()
+    slow.setblocking(False)
+    s.selector.register(slow, selectors.EVENT_READ, s.read)
+    s.decoders[slow] = CDProtoDecoder()
+    s.register_user(slow, "slow")
+
+    for _ in range(2**12):
+        s.send_text(MAIN_CHANNEL, "x" * 1024)
+
+    if policy == DROP:
+        assert s.outbox[slow].size <= s.high_water
+        assert s.selector.get_key(slow).events & selectors.EVENT_WRITE
+        assert s.users == {slow: "slow"}
+    else:
+        assert s.users == {}
+        assert s.channels[MAIN_CHANNEL] == set()
+
+
+def test_channel_bus(tmp_path):
+    """Test that messages reach the members connected to other workers."""
+    bus = [ChannelBus(5010, worker, 2, str(tmp_path)) for worker in range(2)]
+    s1 = Server(port=0, bus=bus[0])
+    s2 = Server(port=0, bus=bus[1])
+    foo, foo_peer = socket.socketpair()
+    s2.register_user(foo, "foo")
+    s2.join_channel(foo, "#cd")
+
+    s1.send_text("#cd", "Hello")
+    s2.relay()
+    msg = CDProto.recv_msg(foo_peer)
+    assert isinstance(msg, TextMessage)
+    assert (msg.channel, msg.message) == ("#cd", "Hello")
+
+    for b in bus:
+        b.close()
+
+
+def test_binary_wire():
+    """Test that binary and JSON clients chat in the same channel."""
+    s = Server(port=0)
+    peers = {}
+    for name in ("foo", "bar"):
+        conn, peers[name] = socket.socketpair()
+        conn.setblocking(False)
+        s.selector.register(conn, selectors.EVENT_READ, s.read)
+        s.decoders[conn] = CDProtoDecoder()
+        wire = BINARY if name == "foo" else None
+        peers[name].sendall(
+            CDProto.encode_msg(CDProto.register(name, wire))
+            + CDProto.encode_msg(CDProto.join("#cd"), wire or JSON)
+        )
+        s.read(conn)
+
+    foo = CDProtoDecoder()
+    foo.wire = BINARY
+    foo.fill(peers["foo"])
+    assert [msg.channel for msg in foo] == ["#cd"]
+
+    peers["foo"].sendall(CDProto.encode_msg(CDProto.message("Hello"), BINARY))
+    s.read(next(conn for conn, user in s.users.items() if user == "foo"))
+
+    foo.fill(peers["foo"])
+    assert [(msg.channel, msg.message) for msg in foo] == [("#cd", "Hello")]
+    msg = CDProto.recv_msg(peers["bar"])
+    assert (msg.channel, msg.message) == ("#cd", "Hello")
+
+
+def test_flush_window():
+    """Test that frames to a client are held back and sent together."""
+    s = Server(port=0, flush_interval=60, flush_frames=4)
+    foo, foo_peer = socket.socketpair()
+    foo.setblocking(False)
+    foo_peer.setblocking(False)
+    s.selector.register(foo, selectors.EVENT_READ, s.read)
+    s.decoders[foo] = CDProtoDecoder()
+    s.register_user(foo, "foo")
+
+    for idx in range(3):
+        s.send_text(MAIN_CHANNEL, f"Hello {idx}")
+    assert s.dirty == {foo}
+    with pytest.raises(BlockingIOError):
+        foo_peer.recv(1)
+
+    s.flush()
+    decoder = CDProtoDecoder()
+    decoder.fill(foo_peer)
+    assert [msg.message for msg in decoder] == ["Hello 0", "Hello 1", "Hello 2"]
+    assert s.dirty == set() and s.outbox == {}
+
+    for idx in range(4):
+        s.send_text(MAIN_CHANNEL, f"Hello {idx}")
+    assert s.dirty == set()
+    decoder.fill(foo_peer)
+    assert len(list(decoder)) == 4
+
+
+def test_history():
+    """Test that users joining a channel get its last messages."""
+    s = Server(port=0, history=3, history_bytes=2**10)
+    foo, foo_peer = socket.socketpair()
+    bar, bar_peer = socket.socketpair()
+    s.register_user(foo, "foo")
+    s.register_user(bar, "bar")
+    s.join_channel(foo, "#cd")
+
+    for idx in range(5):
+        s.send_text("#cd", f"Hello {idx}")
+    s.send_text("#cd", "x" * 2**10)
+    assert len(s.history["#cd"]) == 3
+
+    s.join_channel(bar, "#cd")
+    bar_peer.setblocking(False)
+    decoder = CDProtoDecoder()
+    decoder.fill(bar_peer)
+    assert [msg.message for msg in decoder] == ["Hello 2", "Hello 3", "Hello 4"]
+
+    s.send_text("#cd", "y" * 900)
+    assert len(s.history["#cd"]) == 1
+
+
+def test_idle_reaper():
+    """Test that silent clients are pinged, and reaped unless they answer."""
+    s = Server(port=0, idle_timeout=1)
+    start = s.timers.next_tick
+    foo_peer = socket.create_connection(s.socket.getsockname())
+    bar_peer = socket.create_connection(s.socket.getsockname())
+    s.accept(s.socket)
+    s.accept(s.socket)
+    foo, bar = s.decoders
+
+    s.reap_idle(start + 1.1)
+    assert s.pinged == {foo, bar}
+    decoder = CDProtoDecoder()
+    decoder.fill(foo_peer)
+    assert [type(msg) for msg in decoder] == [PingMessage]
+
+    CDProto.send_msg(bar_peer, CDProto.pong())
+    s.read(bar)
+    s.reap_idle(start + 2.2)
+    assert foo not in s.decoders and bar in s.decoders
+    assert not s.pinged
+
+    s.reap_idle(start + 4.4)
+    assert s.pinged == {bar}
+
+
+def test_stats_endpoint():
+    """Test that the statistics count messages and are served over HTTP."""
+    s = Server(port=0, stats_port=0)
+    foo, foo_peer = socket.socketpair()
+    bar, bar_peer = socket.socketpair()
+    s.decoders[foo] = s.decoders[bar] = CDProtoDecoder()
+    s.handle(foo, CDProto.register("foo"))
+    s.handle(bar, CDProto.register("bar"))
+    s.handle(foo, CDProto.message("Hello"))
+
+    snapshot = s.snapshot()
+    assert snapshot["connections"] == 2
+    assert snapshot["messages"] == {"in": 3, "out": 2}
+    assert snapshot["fanout"]["buckets"] == {"<4": 1}
+    assert snapshot["latency_us"]["count"] == 3
+    assert snapshot["hot_channels"] == {str(MAIN_CHANNEL): 2}
+
+    client = socket.create_connection(s.stats_socket.getsockname())
+    client.sendall(b"GET / HTTP/1.0\r\n\r\n")
+    for key, mask in s.selector.select(1):
+        key.data(key.fileobj)
+    for key, mask in s.selector.select(1):
+        key.data(key.fileobj)
+    response = client.recv(2**16)
+    assert response.startswith(b"HTTP/1.0 200 OK")
+    assert json.loads(response.split(b"\r\n\r\n", 1)[1])["users"] == 2
+
+
+def test_empty_channels_dropped():
+    """Test that channels are dropped once their last member leaves."""
+    s = Server(port=0, history=3)
+    foo, foo_peer = socket.socketpair()
+    bar, bar_peer = socket.socketpair()
+    s.register_user(foo, "foo")
+    s.register_user(bar, "bar")
+
+    s.join_channel(foo, "#c1")
+    s.join_channel(bar, "#c1")
+    s.send_text("#c1", "Hello")
+    s.join_channel(foo, "#c2")
+    assert set(s.channels) == {MAIN_CHANNEL, "#c1", "#c2"}
+
+    s.join_channel(bar, "#c2")
+    assert set(s.channels) == {MAIN_CHANNEL, "#c2"}
+    assert "#c1" not in s.history
+
+    s.forget_user(foo)
+    s.forget_user(bar)
+    assert s.channels == {MAIN_CHANNEL: set()}
+    assert s.users == s.user_channel == {}
+
+
+def test_sample_filter():
+    """Test that only one in every N debug records of an event is kept."""
+    sample = SampleFilter(3)
+
+    def record(level, msg):
+        return logging.LogRecord("root", level, __file__, 0, msg, (), None)
+
+    kept = [
+        sample.filter(record(logging.DEBUG, "Server %s sends message %s"))
+        for _ in range(7)
+    ]
+    assert kept == [True, False, False, True, False, False, True]
+    assert sample.filter(record(logging.DEBUG, "Server %s unregisters user %s"))
+    assert all(sample.filter(record(logging.WARNING, "slow")) for _ in range(3))
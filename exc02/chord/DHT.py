@@ -5,7 +5,7 @@ import argparse
 from DHTNode import DHTNode
 
 
-def main(number_nodes, timeout):
+def main(number_nodes, timeout, m_bits=10):
     """ Script to launch several DHT nodes. """
 
     # logger for the main
@@ -13,7 +13,7 @@ def main(number_nodes, timeout):
     # list with all the nodes
     dht = []
     # initial node on DHT
-    node = DHTNode(("localhost", 5000))
+    node = DHTNode(("localhost", 5000), m_bits=m_bits)
     node.start()
     dht.append(node)
     logger.info(node)
@@ -21,7 +21,7 @@ def main(number_nodes, timeout):
     for i in range(number_nodes - 1):
         time.sleep(0.2)
         # Create DHT_Node threads on ports 5001++ and with initial DHT_Node on port 5000
-        node = DHTNode(("localhost", 5001 + i), ("localhost", 5000), timeout)
+        node = DHTNode(("localhost", 5001 + i), ("localhost", 5000), timeout, m_bits)
         node.start()
         dht.append(node)
         logger.info(node)
@@ -41,6 +41,7 @@ if __name__ == "__main__":
     parser.add_argument("--savelog", default=False, action="store_true")
     parser.add_argument("--nodes", type=int, default=5)
     parser.add_argument("--timeout", type=int, default=3)
+    parser.add_argument("--bits", type=int, default=10, help="identifier width, up to 160")
     args = parser.parse_args()
 
     logfile = {}
@@ -55,4 +56,4 @@ if __name__ == "__main__":
         )
 
 
-    main(args.nodes, timeout=args.timeout)
+    main(args.nodes, timeout=args.timeout, m_bits=args.bits)
@@ -2,6 +2,9 @@ import socket
 import pickle
 import logging
 
+# largest payload of a UDP datagram
+MAX_DATAGRAM = 65507
+
 
 class DHTClient:
     def __init__(self, address):
@@ -34,6 +37,52 @@ class DHTClient:
             return None
         return out["args"]
 
+    def mput(self, items, batch=64, timeout=5):
+        """ Store several values in the DHT, True once every key is stored.
+
+        Keys are sent batch at a time, each node replies with the keys it stored.
+        """
+        keys = list(items)
+        for idx in range(0, len(keys), batch):
+            args = {"items": {key: items[key] for key in keys[idx : idx + batch]}}
+            self.socket.sendto(pickle.dumps({"method": "MPUT", "args": args}), self.dht_addr)
+
+        pending = set(keys)
+        for args in self.replies(pending, timeout):
+            pending.difference_update(args["keys"])
+        return not pending
+
+    def mget(self, keys, batch=64, timeout=5):
+        """ Retrieve several keys from the DHT, as a dict of the ones found."""
+        keys = list(keys)
+        for idx in range(0, len(keys), batch):
+            args = {"keys": keys[idx : idx + batch]}
+            self.socket.sendto(pickle.dumps({"method": "MGET", "args": args}), self.dht_addr)
+
+        values = dict()
+        pending = set(keys)
+        for args in self.replies(pending, timeout):
+            values.update(args["values"])
+            pending.difference_update(args["values"])
+            pending.difference_update(args["missing"])
+        return values
+
+    def replies(self, pending, timeout):
+        """ Yield the args of MACK replies until pending is empty or timeout expires."""
+        self.socket.settimeout(timeout)
+        try:
+            while pending:
+                pickled_msg, addr = self.socket.recvfrom(MAX_DATAGRAM)
+                out = pickle.loads(pickled_msg)
+                if out["method"] == "MACK":
+                    yield out["args"]
+                else:
+                    self.logger.error("Invalid msg: %s", out)
+        except socket.timeout:
+            self.logger.error("Missing replies for %d keys", len(pending))
+        finally:
+            self.socket.settimeout(None)
+
 
 if __name__ == "__main__":
     client = DHTClient(("localhost", 5000))
@@ -3,8 +3,12 @@ import socket
 import threading
 import logging
 import pickle
+from bisect import bisect_left
 from utils import dht_hash, contains
 
+# largest payload of a UDP datagram
+MAX_DATAGRAM = 65507
+
 
 class FingerTable:
     """Finger Table."""
@@ -14,36 +18,51 @@ class FingerTable:
         self.node_id = node_id
         self.node_addr = node_addr
         self.m_bits = m_bits
+        self.size = 2 ** m_bits
 
-        self.fingertable = list()
-        self.indexes = dict()
-        for i in range(self.m_bits):
-            self.fingertable.append((self.node_id, self.node_addr))
-            self.indexes[(self.node_id + 2 ** i) % (2 ** self.m_bits)] = i+1
+        # entry i + 1 points to the successor of starts[i]
+        self.starts = [(node_id + 2 ** i) % self.size for i in range(m_bits)]
+        self.indexes = {start: i + 1 for i, start in enumerate(self.starts)}
+        self.fingertable = [(self.node_id, self.node_addr)] * m_bits
+        # distinct fingers sorted by distance from node_id, with their addresses
+        self.distances = list()
+        self.addrs = list()
 
     def fill(self, node_id, node_addr):
         """ Fill all entries of finger_table with node_id, node_addr."""
-        for i in range(self.m_bits):
-            self.fingertable[i] = (node_id, node_addr)
+        self.fingertable = [(node_id, node_addr)] * self.m_bits
+        self.reindex()
 
     def update(self, index, node_id, node_addr):
         """Update index of table with node_id and node_addr."""
-        self.fingertable[index-1] = (node_id, node_addr)
+        if self.fingertable[index-1] != (node_id, node_addr):
+            self.fingertable[index-1] = (node_id, node_addr)
+            self.reindex()
+
+    def reindex(self):
+        """ Rebuild the sorted distances searched by find."""
+        fingers = dict()
+        for finger_id, finger_addr in self.fingertable:
+            distance = (finger_id - self.node_id) % self.size
+            if distance:
+                fingers[distance] = finger_addr
+        self.distances = sorted(fingers)
+        self.addrs = [fingers[distance] for distance in self.distances]
 
     def find(self, identification):
         """ Get node address of closest preceding node (in finger table) of identification. """
-        for idx in range(self.m_bits):
-            if contains(self.node_id, identification, self.fingertable[idx][0]):
-                return self.fingertable[idx][1]
+        # fingers strictly between node_id and identification are the ones closer to it
+        idx = bisect_left(self.distances, (identification - self.node_id) % self.size)
+        if idx:
+            return self.addrs[idx-1]
         return self.fingertable[0][1]
 
     def refresh(self):
         """ Retrieve finger table entries."""
-        lst = list()
-        for idx in range(self.m_bits):
-            id = (self.node_id + 2 ** idx) % (2 ** self.m_bits)
-            lst.append((idx+1, id, self.fingertable[idx][1]))
-        return lst
+        return [
+            (idx+1, start, self.fingertable[idx][1])
+            for idx, start in enumerate(self.starts)
+        ]
 
     def getIdxFromId(self, id):
         return self.indexes[id]
@@ -61,17 +80,19 @@ class FingerTable:
 class DHTNode(threading.Thread):
     """ DHT Node Agent. """
 
-    def __init__(self, address, dht_address=None, timeout=3):
+    def __init__(self, address, dht_address=None, timeout=3, m_bits=10):
         """Constructor
 
         Parameters:
             address: self's address
             dht_address: address of a node in the DHT
             timeout: impacts how often stabilize algorithm is carried out
+            m_bits: width of the identifiers, the same in every node (up to 160)
         """
         threading.Thread.__init__(self)
         self.done = False
-        self.identification = dht_hash(address.__str__())
+        self.m_bits = m_bits
+        self.identification = dht_hash(address.__str__(), maximum=2 ** m_bits)
         self.addr = address  # My address
         self.dht_address = dht_address  # Address of the initial Node
         if dht_address is None:
@@ -88,7 +109,7 @@ class DHTNode(threading.Thread):
             self.predecessor_id = None
             self.predecessor_addr = None
 
-        self.finger_table = FingerTable(self.identification, self.addr)
+        self.finger_table = FingerTable(self.identification, self.addr, m_bits)
 
         self.keystore = {}  # Where all data is stored
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -103,7 +124,7 @@ class DHTNode(threading.Thread):
     def recv(self):
         """ Retrieve msg payload and from address."""
         try:
-            payload, addr = self.socket.recvfrom(1024)
+            payload, addr = self.socket.recvfrom(MAX_DATAGRAM)
         except socket.timeout:
             return None, None
 
@@ -215,7 +236,7 @@ class DHTNode(threading.Thread):
         value: data to be stored
         address: address where to send ack/nack
         """
-        key_hash = dht_hash(key)
+        key_hash = dht_hash(key, maximum=2 ** self.m_bits)
         self.logger.debug("Put: %s %s", key, key_hash)
 
         #TODO Replace next code:(done)
@@ -235,7 +256,7 @@ class DHTNode(threading.Thread):
         key: key of the data
         address: address where to send ack/nack
         """
-        key_hash = dht_hash(key)
+        key_hash = dht_hash(key, maximum=2 ** self.m_bits)
         self.logger.debug("Get: %s %s", key, key_hash)
 
         #TODO Replace next code:(done)
@@ -247,6 +268,66 @@ class DHTNode(threading.Thread):
         else:
             self.send(self.finger_table.find(key_hash), {"method": "GET", "args": {"key": key, "from": address}})
 
+    def route(self, keys):
+        """Split keys into the ones stored here and the ones of each next hop."""
+        local = list()
+        hops = dict()
+        for key in keys:
+            key_hash = dht_hash(key, maximum=2 ** self.m_bits)
+            if contains(self.predecessor_id, self.identification, key_hash):
+                local.append(key)
+            else:
+                hops.setdefault(self.finger_table.find(key_hash), []).append(key)
+        return local, hops
+
+    def mput(self, items, address):
+        """Store several values in DHT, forwarding the others in one message per hop.
+
+        Parameters:
+        items: dict of the data by key
+        address: address where to send the keys stored
+        """
+        self.logger.debug("MPut: %d keys", len(items))
+        local, hops = self.route(items)
+        for node_addr, keys in hops.items():
+            batch = {key: items[key] for key in keys}
+            self.send(node_addr, {"method": "MPUT", "args": {"items": batch, "from": address}})
+        if local:
+            for key in local:
+                self.keystore[key] = items[key]
+            self.send(address, {"method": "MACK", "args": {"keys": local}})
+
+    def mget(self, keys, address):
+        """Retrieve several values from DHT, forwarding the others in one message per hop.
+
+        Parameters:
+        keys: list of keys of the data
+        address: address where to send the values found and the keys missing
+        """
+        self.logger.debug("MGet: %d keys", len(keys))
+        local, hops = self.route(keys)
+        for node_addr, batch in hops.items():
+            self.send(node_addr, {"method": "MGET", "args": {"keys": batch, "from": address}})
+        if local:
+            values = {key: self.keystore[key] for key in local if key in self.keystore}
+            missing = [key for key in local if key not in self.keystore]
+            self.reply_values(address, values, missing)
+
+    def reply_values(self, address, values, missing):
+        """Send values found by mget, split in as many datagrams as needed."""
+        msg = {"method": "MACK", "args": {"values": values, "missing": missing}}
+        payload = pickle.dumps(msg)
+        if len(payload) > MAX_DATAGRAM and len(values) + len(missing) > 1:
+            keys = list(values) + missing
+            for half in (keys[: len(keys) // 2], keys[len(keys) // 2 :]):
+                self.reply_values(
+                    address,
+                    {key: values[key] for key in half if key in values},
+                    [key for key in half if key not in values],
+                )
+            return
+        self.socket.sendto(payload, address)
+
     def run(self):
         self.socket.bind(self.addr)
 
@@ -286,6 +367,10 @@ class DHTNode(threading.Thread):
                     )
                 elif output["method"] == "GET":
                     self.get(output["args"]["key"], output["args"].get("from", addr))
+                elif output["method"] == "MPUT":
+                    self.mput(output["args"]["items"], output["args"].get("from", addr))
+                elif output["method"] == "MGET":
+                    self.mget(output["args"]["keys"], output["args"].get("from", addr))
                 elif output["method"] == "PREDECESSOR":
                     # Reply with predecessor id
                     self.send(
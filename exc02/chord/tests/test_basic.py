@@ -26,3 +26,14 @@ def test_put_remote(client):
 def test_get_remote(client):
     """ retrieve from DHT (this key is not on the first node -> remote search) """
     assert client.get("2") == "xpto"
+
+
+def test_mput(client):
+    """ add many objects to DHT, spread over every node, in batches """
+    assert client.mput({"key{}".format(idx): idx for idx in range(500)})
+
+
+def test_mget(client):
+    """ retrieve many objects from DHT, missing keys are left out """
+    keys = ["key{}".format(idx) for idx in range(500)] + ["missing"]
+    assert client.mget(keys) == {"key{}".format(idx): idx for idx in range(500)}
@@ -1,6 +1,9 @@
 """Tests finger table."""
+import random
+
 import pytest
 from DHTNode import FingerTable
+from utils import contains
 
 
 def test_finger_table():
@@ -35,3 +38,24 @@ def test_finger_table():
         (3, 14, ("localhost", 5003)),
         (4, 2, ("localhost", 5004)),
     ]
+
+
+def test_finger_table_wide():
+    """ find agrees with a linear scan for closest preceding fingers on a 64 bit ring."""
+    random.seed(42)
+    size = 2 ** 64
+    node_id = random.randrange(size)
+    f = FingerTable(node_id, ("localhost", 5000), 64)
+    for idx in range(1, 65):
+        finger_id = random.randrange(size)
+        f.update(idx, finger_id, ("localhost", finger_id))
+
+    for _ in range(1000):
+        identification = random.randrange(size)
+        closest = None
+        for finger_id, addr in f.as_list:
+            if finger_id != identification and contains(node_id, identification, finger_id):
+                if closest is None or contains(closest[0], identification, finger_id):
+                    closest = (finger_id, addr)
+        expected = closest[1] if closest else f.as_list[0][1]
+        assert f.find(identification) == expected
@@ -1,6 +1,6 @@
 """Tests two clients."""
 import pytest
-from utils import contains
+from utils import contains, dht_hash
 
 
 def test_contains():
@@ -17,3 +17,18 @@ def test_contains():
     assert contains(800, 300, 300)
     assert not contains(800, 300, 700)
     assert not contains(800, 300, 400)
+
+
+def test_dht_hash():
+    assert dht_hash("d") == 115
+    assert dht_hash("f") == 921
+    assert dht_hash(b"f") == dht_hash("f")
+    assert dht_hash("f", maximum=2**32) % 2**10 == 921
+
+    for bits in (64, 160):
+        ids = {dht_hash(str(key), maximum=2**bits) for key in range(1000)}
+        assert len(ids) == 1000
+        assert all(0 <= identifier < 2**bits for identifier in ids)
+
+    with pytest.raises(ValueError):
+        dht_hash("f", maximum=2**161)
@@ -1,12 +1,34 @@
+import hashlib
+
+# FNV-1a works on 32 bit words, wider rings hash with BLAKE2
+FNV_BITS = 32
+MAX_BITS = 160
+
+
 def dht_hash(text, seed=0, maximum=2**10):
-    """ FNV-1a Hash Function. """
+    """ Hash text (str or bytes) into an identifier in [0, maximum[.
+
+    maximum is a power of two up to 2**160. Up to 2**32 this is FNV-1a over the
+    UTF-8 bytes of text, keeping only the bits that reach the result.
+    """
+    data = text.encode("utf-8") if isinstance(text, str) else bytes(text)
+    bits = maximum.bit_length() - 1
+    if bits > FNV_BITS:
+        if bits > MAX_BITS:
+            raise ValueError("identifiers are limited to {} bits".format(MAX_BITS))
+        digest = hashlib.blake2b(
+            data, digest_size=(bits + 7) // 8, salt=seed.to_bytes(16, "little")
+        ).digest()
+        return int.from_bytes(digest, "big") % maximum
+
     fnv_prime = 16777619
     offset_basis = 2166136261
-    h = offset_basis + seed
-    for char in text:
-        h = h ^ ord(char)
-        h = h * fnv_prime
-    return h % maximum
+    # multiplication and xor commute with dropping the high bits of h
+    mask = maximum - 1
+    h = (offset_basis + seed) & mask
+    for byte in data:
+        h = ((h ^ byte) * fnv_prime) & mask
+    return h
 
 
 def contains(begin, end, node):
@@ -15,4 +37,4 @@ def contains(begin, end, node):
         return True
     elif begin > end and (node <= end or node > begin):
         return True
-    return False
\ No newline at end of file
+    return False